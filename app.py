@@ -1,14 +1,26 @@
-from flask import Flask, request, jsonify, send_file, render_template_string
+from flask import Flask, request, jsonify, render_template_string
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 from flask_cors import CORS
 from flasgger import Swagger
+import functools
+import json
 import os
-import tempfile
+import threading
+import time
 import torch
 import numpy as np
-import sphn
 from moshi.models.loaders import CheckpointInfo
 from moshi.models.tts import DEFAULT_DSM_TTS_REPO, DEFAULT_DSM_TTS_VOICE_REPO, TTSModel
-from gpu_manager import gpu_manager
+from audio_encoding import MIMETYPES, iter_encoded
+from audio_cache import PhraseAudioCache, cache_key
+from gpu_manager import gpu_managers
+from metrics import TIME_TO_FIRST_AUDIO, ReplicaCollector, stage, timed_iter
+from quality import MAX_N_Q, quality_n_q
+from voice_clone import SAMPLE_RATE, encode_references, iter_uploads, load_reference, load_references, save_embeddings, voice_name_from_filename
+from voice_store import VoiceStore, build_default
+from longform import split_segments, stitch
+from tts_pool import TTSPool
+from tts_scheduler import PRIORITIES, Overloaded, decode_frames
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max
@@ -20,22 +32,132 @@ DEVICE = os.getenv('DEVICE', 'cuda')
 HF_REPO = os.getenv('HF_REPO', 'kyutai/tts-1.6b-en_fr')
 VOICE_REPO = os.getenv('VOICE_REPO', DEFAULT_DSM_TTS_VOICE_REPO)
 DEFAULT_VOICE = os.getenv('DEFAULT_VOICE', 'expresso/ex03-ex01_happy_001_channel1_334s.wav')
+TTS_BATCH_SIZE = int(os.getenv('TTS_BATCH_SIZE', 8))
+VOICE_CACHE_MB = int(os.getenv('VOICE_CACHE_MB', 256))
+TTS_COMPILE = os.getenv('TTS_COMPILE', '0') == '1'
+TTS_MAX_QUEUE = int(os.getenv('TTS_MAX_QUEUE', 64))
+# Seconds an interactive request waits for a batch row at most, unless it sends
+# its own `deadline` (0 disables); batch requests have none by default.
+TTS_INTERACTIVE_DEADLINE = float(os.getenv('TTS_INTERACTIVE_DEADLINE', 30))
+VOICE_STORE_DIR = os.getenv('VOICE_STORE_DIR', '/app/voice_store')
+CUSTOM_VOICE_DIR = '/app/custom_voices'
+AUDIO_CACHE_MB = int(os.getenv('AUDIO_CACHE_MB', 256))
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', '/app/audio_cache')
+AUDIO_CACHE_DISK_MB = int(os.getenv('AUDIO_CACHE_DISK_MB', 2048))
+TTS_TEMP = 0.6
 
-def load_model():
+# Mimi keeps its streaming state on the modules, so decode/encode calls from
+# concurrent request threads must not interleave.
+mimi_lock = threading.Lock()
+
+def load_model(device=DEVICE):
     checkpoint_info = CheckpointInfo.from_hf_repo(HF_REPO)
-    return TTSModel.from_checkpoint_info(checkpoint_info, n_q=32, temp=0.6, device=DEVICE)
+    return TTSModel.from_checkpoint_info(checkpoint_info, n_q=MAX_N_Q, temp=TTS_TEMP, device=device)
+
+@functools.lru_cache(maxsize=None)
+def model_revision():
+    model_id = CheckpointInfo.from_hf_repo(HF_REPO).model_id
+    return f"{HF_REPO}@{model_id.get('sig', '')}:{model_id.get('epoch', '')}"
+
+pool = TTSPool(
+    gpu_managers,
+    load_model,
+    max_batch_size=TTS_BATCH_SIZE,
+    voice_cache_bytes=VOICE_CACHE_MB * 1024**2,
+    compile=TTS_COMPILE,
+    max_queue=TTS_MAX_QUEUE,
+)
+REGISTRY.register(ReplicaCollector(pool))
+voice_store = VoiceStore(VOICE_STORE_DIR)
+# Memory tier only until `prepare_service` opens the disk tier, so importing
+# this module does not touch AUDIO_CACHE_DIR.
+audio_cache = PhraseAudioCache(AUDIO_CACHE_MB * 1024**2)
+
+def resolve_voice_path(tts_model, voice):
+    if voice.startswith('custom/'):
+        return f"{CUSTOM_VOICE_DIR}/{voice.replace('custom/', '')}"
+    if voice.endswith('.safetensors'):
+        return voice
+    return tts_model.get_voice_path(voice)
+
+def voice_condition(replica, tts_model, voice, cfg_coef):
+    # Voices in the store are sliced from the mmapped blob, everything else
+    # is resolved to a safetensors file on a cache miss. Custom voices never
+    # come from the store (an older one may still hold a stale copy), so a
+    # re-upload takes effect through the file path cache key.
+    with stage('conditioning'):
+        embedding = None if voice.startswith('custom/') else voice_store.get(voice)
+        if embedding is None:
+            voice_path = resolve_voice_path(tts_model, voice)
+        else:
+            voice_path = voice
+        return replica.voice_cache.get(tts_model, voice_path, cfg_coef, embedding=embedding)
+
+def prepare_script(tts_model, text):
+    with stage('prepare_script'):
+        return tts_model.prepare_script([text], padding_between=1)
+
+def encode_audio(pcm, sample_rate, fmt):
+    # WAV chunks are produced lazily as the response is sent, Opus up front;
+    # both count towards the `encode` stage.
+    start = time.perf_counter()
+    chunks, mimetype = iter_encoded(pcm, sample_rate, fmt)
+    return timed_iter(chunks, 'encode', elapsed=time.perf_counter() - start), mimetype
+
+def phrase_cache_key(form, text, voice, cfg_coef, n_q):
+    """Audio cache key for a request that opted in with `cache=1` or a `seed`, else None.
+
+    Sampling is not deterministic, so caching is never implicit. Rows share one
+    batch, so `seed` is not applied to the generator: it names a take, and the
+    first synthesis under a seed is the one replayed for it.
+    """
+    seed = form.get('seed') or None
+    if seed is None and form.get('cache', '').lower() not in ('1', 'true', 'yes'):
+        return None
+    if voice.startswith('custom/'):
+        # Re-uploading a custom voice under the same name must not replay the old one.
+        path = f"{CUSTOM_VOICE_DIR}/{voice.replace('custom/', '')}"
+        voice = f'{voice}@{os.path.getmtime(path) if os.path.exists(path) else 0}'
+    return cache_key(text, voice, cfg_coef, n_q=n_q, temp=TTS_TEMP, seed=seed, revision=model_revision())
+
+def request_options(params, default_priority='interactive'):
+    """`(n_q, priority, deadline)` from the `quality`, `priority` and `deadline`
+    parameters; raises ValueError on unknown values."""
+    n_q = quality_n_q(params.get('quality'))
+    priority = params.get('priority') or default_priority
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{priority}', expected one of {sorted(PRIORITIES)}")
+    deadline = params.get('deadline')
+    if deadline is None and priority == 'interactive':
+        deadline = TTS_INTERACTIVE_DEADLINE
+    deadline = float(deadline) if deadline is not None else None
+    return n_q, priority, deadline or None
+
+def overloaded_response(e):
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def iter_cached_pcm(pcm, chunk_size=1920):
+    for start in range(0, len(pcm), chunk_size):
+        yield (pcm[start : start + chunk_size] * 32767).astype(np.int16).tobytes()
 
 @app.route('/')
 def index():
     return render_template_string(UI_HTML)
 
+def available_voices():
+    if len(voice_store):
+        return [v for v in voice_store.names() if not v.startswith('custom/')]
+    from huggingface_hub import list_repo_files
+    files = list_repo_files(VOICE_REPO)
+    return sorted([f.replace('.1e68beda@240.safetensors', '') for f in files if f.endswith('.safetensors')])
+
 @app.route('/api/voices')
 def list_voices():
     """List all available voices"""
-    from huggingface_hub import list_repo_files
-    files = list_repo_files(VOICE_REPO)
-    voices = sorted([f.replace('.1e68beda@240.safetensors', '') for f in files if f.endswith('.safetensors')])
-    return jsonify({'voices': voices})
+    return jsonify({'voices': available_voices()})
 
 @app.route('/health')
 def health():
@@ -69,108 +191,360 @@ def tts():
         type: number
         required: false
         default: 0.6
+      - name: quality
+        in: formData
+        type: string
+        required: false
+        enum: [fast, balanced, best]
+        description: Quality tier, i.e. number of audio codebooks generated (TTS_QUALITY_TIERS)
+      - name: format
+        in: formData
+        type: string
+        required: false
+        default: wav
+        enum: [wav, opus]
+        description: wav (16-bit PCM) or opus (Ogg/Opus)
+      - name: cache
+        in: formData
+        type: boolean
+        required: false
+        default: false
+        description: Serve and store the audio in the phrase cache
+      - name: seed
+        in: formData
+        type: string
+        required: false
+        description: Cached take to replay (implies cache)
+      - name: priority
+        in: formData
+        type: string
+        required: false
+        default: interactive
+        enum: [interactive, batch]
+        description: Admission class; interactive requests are served first
+      - name: deadline
+        in: formData
+        type: number
+        required: false
+        description: Max seconds to wait for a batch slot before answering 429/503 with Retry-After
     responses:
       200:
         description: Audio file
         content:
           audio/wav: {}
+          audio/ogg: {}
+      429:
+        description: Batch request shed by admission control (see Retry-After)
+      503:
+        description: Interactive request shed by admission control (see Retry-After)
     """
+    start = time.perf_counter()
     text = request.form.get('text', '')
     voice = request.form.get('voice', DEFAULT_VOICE)
     cfg_coef = float(request.form.get('cfg_coef', 2.0))
+    fmt = request.form.get('format', 'wav')
     
     if not text:
         return jsonify({'error': 'No text provided'}), 400
+    if fmt not in MIMETYPES:
+        return jsonify({'error': f"Unsupported format '{fmt}'"}), 400
+    try:
+        n_q, priority, deadline = request_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
-        tts_model = gpu_manager.get_model(load_model)
-        entries = tts_model.prepare_script([text], padding_between=1)
-        
-        # Get voice path
-        if voice.startswith('custom/'):
-            voice_path = f"/app/custom_voices/{voice.replace('custom/', '')}"
-            print(f"Using custom voice: {voice_path}")
-            print(f"File exists: {os.path.exists(voice_path)}")
-        elif voice.endswith('.safetensors'):
-            voice_path = voice
-        else:
-            voice_path = tts_model.get_voice_path(voice)
-        
-        print(f"Final voice_path: {voice_path}")
-        condition_attributes = tts_model.make_condition_attributes([voice_path], cfg_coef=cfg_coef)
-        
-        result = tts_model.generate([entries], [condition_attributes])
-        
-        with tts_model.mimi.streaming(1), torch.no_grad():
-            pcms = []
-            for frame in result.frames[tts_model.delay_steps:]:
-                pcm = tts_model.mimi.decode(frame[:, 1:, :]).cpu().numpy()
-                pcms.append(np.clip(pcm[0, 0], -1, 1))
-            pcm = np.concatenate(pcms, axis=-1)
+        key = phrase_cache_key(request.form, text, voice, cfg_coef, n_q)
+        pcm = audio_cache.get(key) if key is not None else None
+        if pcm is None:
+            replica = pool.route()
+            tts_scheduler = replica.get_scheduler()
+            tts_model = tts_scheduler.tts_model
+            entries = prepare_script(tts_model, text)
+            condition = voice_condition(replica, tts_model, voice, cfg_coef)
+            
+            job = tts_scheduler.submit(
+                entries, condition.attributes, condition.condition_tensors, n_q=n_q, priority=priority, deadline=deadline
+            )
+            frames = job.wait()
+            
+            with mimi_lock:
+                pcm = decode_frames(tts_model.mimi, frames)
+            if key is not None:
+                audio_cache.put(key, pcm)
         
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
-            sphn.write_wav(f.name, pcm, tts_model.mimi.sample_rate)
-            return send_file(f.name, mimetype='audio/wav')
+        chunks, mimetype = encode_audio(pcm, SAMPLE_RATE, fmt)
+        TIME_TO_FIRST_AUDIO.labels('tts').observe(time.perf_counter() - start)
+        return app.response_class(chunks, mimetype=mimetype)
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def gpu_status_summary():
+    replicas = pool.status()
+    primary = replicas[0]
+    return {
+        'loaded': any(r['state'] == 'resident' for r in replicas),
+        'state': primary['state'],
+        'memory_used_gb': primary.get('memory_used_gb', 0),
+        'memory_total_gb': primary.get('memory_total_gb', 0),
+        'batch_size': TTS_BATCH_SIZE,
+        'replicas': replicas
+    }
+
 @app.route('/api/gpu/status')
 def gpu_status():
     """GPU Status"""
-    if torch.cuda.is_available():
-        mem_used = torch.cuda.memory_allocated() / 1024**3
-        mem_total = torch.cuda.get_device_properties(0).total_memory / 1024**3
-        return jsonify({
-            'loaded': gpu_manager.model is not None,
-            'memory_used_gb': round(mem_used, 2),
-            'memory_total_gb': round(mem_total, 2)
-        })
-    return jsonify({'loaded': False})
+    return jsonify(gpu_status_summary())
+
+def _selected_replicas():
+    index = request.args.get('replica')
+    if index is None:
+        return pool.replicas
+    return [pool.replicas[int(index)]]
 
 @app.route('/api/gpu/offload', methods=['POST'])
 def gpu_offload():
-    """Offload GPU"""
-    gpu_manager.force_offload()
-    return jsonify({'status': 'offloaded'})
+    """Offload GPU (mode=cold drops the weights, mode=standby parks them in pinned host memory; replica=N targets one replica)"""
+    for replica in _selected_replicas():
+        if request.args.get('mode', 'cold') == 'standby':
+            replica.manager.offload()
+        else:
+            replica.manager.force_offload()
+    return jsonify({'status': 'offloaded', 'replicas': pool.status()})
+
+@app.route('/api/gpu/drain', methods=['POST'])
+def gpu_drain():
+    """Stop routing to a replica and offload it once its in-flight requests finish (resume=1 re-enables it)"""
+    for replica in _selected_replicas():
+        if request.args.get('resume'):
+            replica.manager.resume()
+        else:
+            replica.manager.drain(mode=request.args.get('mode', 'standby'))
+    return jsonify({'status': 'ok', 'replicas': pool.status()})
 
 @app.route('/api/tts/stream', methods=['POST'])
 def tts_stream():
     """Streaming TTS"""
+    start = time.perf_counter()
     text = request.form.get('text', '')
     voice = request.form.get('voice', DEFAULT_VOICE)
     cfg_coef = float(request.form.get('cfg_coef', 2.0))
     
     if not text:
         return jsonify({'error': 'No text'}), 400
+    try:
+        n_q, priority, deadline = request_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Everything up to the submit happens before the response starts, so a
+    # shed request still gets a proper status code.
+    try:
+        key = phrase_cache_key(request.form, text, voice, cfg_coef, n_q)
+        cached = audio_cache.get(key) if key is not None else None
+        job = None
+        if cached is None:
+            replica = pool.route()
+            tts_scheduler = replica.get_scheduler()
+            tts_model = tts_scheduler.tts_model
+            entries = prepare_script(tts_model, text)
+            condition = voice_condition(replica, tts_model, voice, cfg_coef)
+            
+            # PCM chunks are decoded by the scheduler as frames are generated,
+            # so the first bytes go out after a couple of model steps.
+            job = tts_scheduler.submit(
+                entries,
+                condition.attributes,
+                condition.condition_tensors,
+                stream=True,
+                n_q=n_q,
+                priority=priority,
+                deadline=deadline,
+            )
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
     
     def generate():
+        if cached is not None:
+            TIME_TO_FIRST_AUDIO.labels('tts_stream').observe(time.perf_counter() - start)
+            yield from iter_cached_pcm(cached)
+            return
         try:
-            tts_model = gpu_manager.get_model(load_model)
-            entries = tts_model.prepare_script([text], padding_between=1)
-            
-            # Get voice path
-            if voice.startswith('custom/'):
-                voice_path = f"/app/custom_voices/{voice.replace('custom/', '')}"
-            elif voice.endswith('.safetensors'):
-                voice_path = voice
-            else:
-                voice_path = tts_model.get_voice_path(voice)
-            
-            condition_attributes = tts_model.make_condition_attributes([voice_path], cfg_coef=cfg_coef)
-            
-            result = tts_model.generate([entries], [condition_attributes])
-            
-            with tts_model.mimi.streaming(1), torch.no_grad():
-                for frame in result.frames[tts_model.delay_steps:]:
-                    pcm = tts_model.mimi.decode(frame[:, 1:, :]).cpu().numpy()
-                    pcm_clip = np.clip(pcm[0, 0], -1, 1)
-                    pcm_int16 = (pcm_clip * 32767).astype(np.int16)
-                    yield pcm_int16.tobytes()
+            pcms = []
+            first = True
+            for pcm in job.iter_pcm():
+                if first:
+                    TIME_TO_FIRST_AUDIO.labels('tts_stream').observe(time.perf_counter() - start)
+                    first = False
+                if key is not None:
+                    pcms.append(pcm)
+                yield (pcm * 32767).astype(np.int16).tobytes()
+            # Only a stream that ran to the end is stored.
+            if key is not None and not job.cancelled:
+                audio_cache.put(key, np.concatenate(pcms) if pcms else np.zeros(0, dtype=np.float32))
         except Exception as e:
             yield str(e).encode()
+        finally:
+            job.cancel()
     
     return app.response_class(generate(), mimetype='audio/wav')
 
+@app.route('/api/tts/longform', methods=['POST'])
+def tts_longform():
+    """
+    Long-form Text-to-Speech API
+    ---
+    tags:
+      - TTS
+    description: Splits the text into sentence segments that are synthesized concurrently
+      in the batch scheduler, then stitched into one file. Per-segment timings (index,
+      start, end and done_after, without the segment text so the header stays small
+      for long inputs) are returned as JSON in the X-Segment-Timings header.
+    parameters:
+      - name: text
+        in: formData
+        type: string
+        required: true
+      - name: voice
+        in: formData
+        type: string
+        required: false
+      - name: cfg_coef
+        in: formData
+        type: number
+        required: false
+        default: 2.0
+      - name: quality
+        in: formData
+        type: string
+        required: false
+        enum: [fast, balanced, best]
+        description: Quality tier, i.e. number of audio codebooks generated (TTS_QUALITY_TIERS)
+      - name: format
+        in: formData
+        type: string
+        required: false
+        default: wav
+        enum: [wav, opus]
+      - name: max_chars
+        in: formData
+        type: integer
+        required: false
+        default: 400
+        description: Max characters per segment (whole sentences are kept together)
+      - name: silence
+        in: formData
+        type: number
+        required: false
+        default: 0.3
+        description: Seconds of silence between segments
+      - name: crossfade
+        in: formData
+        type: number
+        required: false
+        default: 0.05
+        description: Seconds of fade at each seam (overlap length when silence is 0)
+      - name: priority
+        in: formData
+        type: string
+        required: false
+        default: batch
+        enum: [interactive, batch]
+        description: Admission class; interactive requests are served first
+      - name: deadline
+        in: formData
+        type: number
+        required: false
+        description: Max seconds to wait for a batch slot before answering 429/503 with Retry-After
+    responses:
+      200:
+        description: Audio file
+      429:
+        description: Shed by admission control (see Retry-After)
+    """
+    text = request.form.get('text', '')
+    voice = request.form.get('voice', DEFAULT_VOICE)
+    cfg_coef = float(request.form.get('cfg_coef', 2.0))
+    fmt = request.form.get('format', 'wav')
+    max_chars = int(request.form.get('max_chars', 400))
+    silence = float(request.form.get('silence', 0.3))
+    crossfade = float(request.form.get('crossfade', 0.05))
+    
+    segments = split_segments(text, max_chars=max_chars)
+    if not segments:
+        return jsonify({'error': 'No text provided'}), 400
+    if fmt not in MIMETYPES:
+        return jsonify({'error': f"Unsupported format '{fmt}'"}), 400
+    try:
+        n_q, priority, deadline = request_options(request.form, default_priority='batch')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def submit_segment(segment):
+        replica = pool.route()
+        tts_scheduler = replica.get_scheduler()
+        tts_model = tts_scheduler.tts_model
+        entries = prepare_script(tts_model, segment)
+        condition = voice_condition(replica, tts_model, voice, cfg_coef)
+        # Only the first segment goes through admission control; once the
+        # request is admitted its remaining segments must not be shed by the
+        # batch share its own earlier segments are holding.
+        job = tts_scheduler.submit(
+            entries,
+            condition.attributes,
+            condition.condition_tensors,
+            n_q=n_q,
+            priority=priority,
+            deadline=deadline,
+            check_admission=not jobs,
+        )
+        jobs.append((tts_model, job))
+    
+    jobs = []
+    try:
+        # Every segment is its own job, so they share batch steps (and
+        # replicas) instead of running as one long autoregressive pass. At
+        # most a batch worth of segments per replica is queued at a time, so
+        # a long chapter does not crowd other requests out of the queue.
+        window = TTS_BATCH_SIZE * len(pool.replicas)
+        start = time.perf_counter()
+        for segment in segments[:window]:
+            submit_segment(segment)
+        
+        pcms = []
+        synthesis_times = []
+        for i in range(len(segments)):
+            tts_model, job = jobs[i]
+            frames = job.wait()
+            if i + window < len(segments):
+                submit_segment(segments[i + window])
+            synthesis_times.append(time.perf_counter() - start)
+            with mimi_lock:
+                pcms.append(decode_frames(tts_model.mimi, frames))
+        sample_rate = jobs[0][0].mimi.sample_rate
+        pcm, spans = stitch(pcms, sample_rate, silence=silence, crossfade=crossfade)
+        
+        timings = [
+            {'index': i, 'start': round(s, 3), 'end': round(e, 3), 'done_after': round(t, 3)}
+            for i, ((s, e), t) in enumerate(zip(spans, synthesis_times))
+        ]
+        chunks, mimetype = encode_audio(pcm, sample_rate, fmt)
+        response = app.response_class(chunks, mimetype=mimetype)
+        response.headers['X-Segment-Timings'] = json.dumps(timings, ensure_ascii=True)
+        return response
+    except Overloaded as e:
+        for _, job in jobs:
+            job.cancel()
+        return overloaded_response(e)
+    except Exception as e:
+        for _, job in jobs:
+            job.cancel()
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/voice/upload', methods=['POST'])
 def upload_custom_voice():
     """Upload custom voice and generate embedding"""
@@ -184,41 +558,17 @@ def upload_custom_voice():
         return jsonify({'error': 'Only WAV files'}), 400
     
     try:
-        import tempfile
-        from safetensors.torch import save_file
-        
-        # Save uploaded WAV temporarily
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp:
-            voice_file.save(tmp.name)
-            tmp_path = tmp.name
-        
-        # Load and process audio
-        wav_np, _ = sphn.read(tmp_path, sample_rate=24000)
-        duration = 10.0  # Use 10 seconds
-        length = int(24000 * duration)
-        wav = torch.from_numpy(wav_np[:, :length]).float()
-        wav = wav.mean(dim=0, keepdim=True)[None]  # Convert to mono
-        
-        # Pad if needed
-        missing = length - wav.shape[-1]
-        if missing > 0:
-            wav = torch.nn.functional.pad(wav, (0, missing))
+        wav = load_reference(voice_file.read())
         
         # Generate embedding using Mimi
-        tts_model = gpu_manager.get_model(load_model)
-        with torch.no_grad():
-            emb = tts_model.mimi.encode_to_latent(wav.to(DEVICE), quantize=False)
-        
-        # Save as safetensors
-        voice_dir = '/app/custom_voices'
-        os.makedirs(voice_dir, exist_ok=True)
-        safetensors_path = os.path.join(voice_dir, f"{voice_name}.safetensors")
-        
-        tensors = {"speaker_wavs": emb.cpu()}
-        save_file(tensors, safetensors_path)
+        tts_model = pool.route().get_model()
+        with mimi_lock:
+            emb, = encode_references(tts_model.mimi, [wav], tts_model.lm.device)
         
-        # Cleanup temp file
-        os.unlink(tmp_path)
+        os.makedirs(CUSTOM_VOICE_DIR, exist_ok=True)
+        safetensors_path = os.path.join(CUSTOM_VOICE_DIR, f"{voice_name}.safetensors")
+        save_embeddings([(emb, safetensors_path)])
+        pool.invalidate_voice(safetensors_path)
         
         return jsonify({
             'status': 'success',
@@ -231,6 +581,84 @@ def upload_custom_voice():
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/voice/upload_batch', methods=['POST'])
+def upload_custom_voices_batch():
+    """Clone many voices at once
+    ---
+    tags:
+      - Voice
+    consumes:
+      - multipart/form-data
+    parameters:
+      - name: voice_files
+        in: formData
+        type: file
+        required: true
+        description: WAV files, or .zip/.tar/.tar.gz archives of WAV files (repeat the field for several). Voice names are taken from the file names.
+    responses:
+      200:
+        description: Per-file report with the voice path or the error of each file
+    """
+    uploads = request.files.getlist('voice_files')
+    if not uploads:
+        return jsonify({'error': 'No voice files'}), 400
+    
+    try:
+        files = list(iter_uploads(uploads))
+        report = [{'file': filename, 'voice_name': voice_name_from_filename(filename)} for filename, _ in files]
+        # Decoding and resampling run in a thread pool; every clip that
+        # loaded is then encoded in as few Mimi passes as possible.
+        wavs = load_references([data for _, data in files])
+        seen = {}
+        for item, wav in zip(report, wavs):
+            if isinstance(wav, Exception):
+                item.update(status='error', error=str(wav))
+            elif item['voice_name'] in seen:
+                item.update(status='error', error=f"Duplicate voice name (also used by {seen[item['voice_name']]})")
+            else:
+                seen[item['voice_name']] = item['file']
+        ok = [(item, wav) for item, wav in zip(report, wavs) if 'status' not in item]
+        
+        if ok:
+            tts_model = pool.route().get_model()
+            with mimi_lock:
+                embeddings = encode_references(tts_model.mimi, [wav for _, wav in ok], tts_model.lm.device)
+            os.makedirs(CUSTOM_VOICE_DIR, exist_ok=True)
+            paths = [os.path.join(CUSTOM_VOICE_DIR, f"{item['voice_name']}.safetensors") for item, _ in ok]
+            save_embeddings(list(zip(embeddings, paths)))
+            for (item, _), path in zip(ok, paths):
+                pool.invalidate_voice(path)
+                item.update(status='success', voice_path=f"custom/{item['voice_name']}.safetensors")
+        
+        return jsonify({
+            'status': 'success' if len(ok) == len(report) else 'partial',
+            'cloned': len(ok),
+            'failed': len(report) - len(ok),
+            'voices': report,
+        })
+    except Exception as e:
+        import traceback
+        print(f"Batch upload error: {str(e)}")
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/voices/cache')
+def voice_cache_stats():
+    """Voice conditioning cache statistics"""
+    return jsonify({'replicas': pool.voice_cache_stats()})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics: per-stage latency, time to first audio, RTF, GPU memory, model loads"""
+    return app.response_class(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+@app.route('/api/tts/cache', methods=['GET', 'DELETE'])
+def phrase_cache_stats():
+    """Phrase audio cache statistics (DELETE empties both tiers)"""
+    if request.method == 'DELETE':
+        audio_cache.clear()
+    return jsonify(audio_cache.stats())
+
 @app.route('/api/voices/custom')
 def list_custom_voices():
     """List custom voices"""
@@ -314,6 +742,14 @@ audio{width:100%;margin-top:15px}
 <option value="stream">Streaming</option>
 </select>
 </div>
+<div class="form-group">
+<label>Quality</label>
+<select id="quality">
+<option value="best">Best</option>
+<option value="balanced">Balanced</option>
+<option value="fast">Fast</option>
+</select>
+</div>
 </div>
 <button onclick="generate()" id="btn" data-i18n="generate">Generate Speech</button>
 <button onclick="downloadAudio()" id="download-btn" style="display:none;background:#059669;margin-left:10px">Download Audio</button>
@@ -405,6 +841,7 @@ const formData=new FormData();
 formData.append('text',text);
 formData.append('voice',voice);
 formData.append('cfg_coef',document.getElementById('cfg').value);
+formData.append('quality',document.getElementById('quality').value);
 try{
 const endpoint=mode==='stream'?'/api/tts/stream':'/api/tts';
 const res=await fetch(endpoint,{method:'POST',body:formData});
@@ -448,8 +885,29 @@ setInterval(updateGPUStatus,5000);
 </script>
 </body></html>'''
 
-if __name__ == '__main__':
+def prepare_service():
+    """Build the voice store if needed, open the audio cache disk tier and load
+    every replica before serving."""
+    global voice_store, audio_cache
+    if not len(voice_store):
+        print("📦 Building voice store...")
+        try:
+            voice_store = build_default(VOICE_STORE_DIR, VOICE_REPO)
+            print(f"✅ {len(voice_store)} voices packed into {VOICE_STORE_DIR}")
+        except Exception as e:
+            print(f"⚠️  Voice store not built, falling back to per-request lookups: {e}")
+    if AUDIO_CACHE_DISK_MB > 0:
+        try:
+            audio_cache = PhraseAudioCache(
+                AUDIO_CACHE_MB * 1024**2, disk_dir=AUDIO_CACHE_DIR, disk_bytes=AUDIO_CACHE_DISK_MB * 1024**2
+            )
+        except OSError as e:
+            print(f"⚠️  Audio cache disk tier disabled, keeping it in memory only: {e}")
     print("🚀 Preloading model to GPU...")
-    gpu_manager.get_model(load_model)
+    for replica in pool.replicas:
+        replica.get_scheduler()
     print("✅ Model loaded and resident in GPU")
+
+if __name__ == '__main__':
+    prepare_service()
     app.run(host='0.0.0.0', port=PORT, debug=False)
@@ -1,14 +1,15 @@
-from flask import Flask, request, jsonify, send_file, render_template_string
+from flask import Flask, request, jsonify, render_template_string
 from flask_cors import CORS
+import dataclasses
 from flasgger import Swagger
 import os
-import tempfile
 import torch
 import numpy as np
-import sphn
 from moshi.models.loaders import CheckpointInfo
 from moshi.models.tts import TTSModel
+from audio_encoding import MIMETYPES, iter_encoded
 from gpu_manager import gpu_manager
+from quality import MAX_N_Q, quality_n_q
 
 app = Flask(__name__)
 CORS(app)
@@ -36,7 +37,7 @@ def load_model():
         raise RuntimeError(f"Model not found in {MODEL_PATH}")
     
     checkpoint_info = CheckpointInfo.from_pretrained(model_dir)
-    return TTSModel.from_checkpoint_info(checkpoint_info, n_q=32, temp=0.6, device=DEVICE)
+    return TTSModel.from_checkpoint_info(checkpoint_info, n_q=MAX_N_Q, temp=0.6, device=DEVICE)
 
 @app.route('/')
 def index():
@@ -62,15 +63,35 @@ def tts():
         in: formData
         type: number
         default: 2.0
+      - name: quality
+        in: formData
+        type: string
+        required: false
+        enum: [fast, balanced, best]
+        description: Quality tier, i.e. number of audio codebooks generated (TTS_QUALITY_TIERS)
+      - name: format
+        in: formData
+        type: string
+        required: false
+        default: wav
+        enum: [wav, opus]
+        description: wav (16-bit PCM) or opus (Ogg/Opus)
     responses:
       200:
         description: Audio file
     """
     text = request.form.get('text', '')
     cfg_coef = float(request.form.get('cfg_coef', 2.0))
+    fmt = request.form.get('format', 'wav')
     
     if not text:
         return jsonify({'error': 'No text provided'}), 400
+    if fmt not in MIMETYPES:
+        return jsonify({'error': f"Unsupported format '{fmt}'"}), 400
+    try:
+        n_q = quality_n_q(request.form.get('quality'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
         tts_model = gpu_manager.get_model(load_model)
@@ -81,7 +102,7 @@ def tts():
         voice_file = os.path.join(voice_dir, 'expresso/ex03-ex01_happy_001_channel1_334s.wav.safetensors')
         
         condition_attributes = tts_model.make_condition_attributes([voice_file], cfg_coef=cfg_coef)
-        result = tts_model.generate([entries], [condition_attributes])
+        result = dataclasses.replace(tts_model, n_q=n_q).generate([entries], [condition_attributes])
         
         with tts_model.mimi.streaming(1), torch.no_grad():
             pcms = []
@@ -90,9 +111,8 @@ def tts():
                 pcms.append(np.clip(pcm[0, 0], -1, 1))
             pcm = np.concatenate(pcms, axis=-1)
         
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
-            sphn.write_wav(f.name, pcm, tts_model.mimi.sample_rate)
-            return send_file(f.name, mimetype='audio/wav')
+        chunks, mimetype = iter_encoded(pcm, tts_model.mimi.sample_rate, fmt)
+        return app.response_class(chunks, mimetype=mimetype)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
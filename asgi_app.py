@@ -0,0 +1,372 @@
+"""ASGI serving mode: `python asgi_app.py` (or `uvicorn asgi_app:app --workers 1`).
+
+The TTS routes are coroutines that only submit jobs to the replica schedulers
+and await them, so an idle or slow connection costs a socket and a queue, not
+an OS thread. GPU work stays off the event loop: generation runs on the
+scheduler threads, and model loads, voice conditioning and Mimi decodes run on
+a small dedicated executor. Every other route of the Flask app (UI, docs,
+uploads, GPU controls) is mounted behind these and served through a thread pool.
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import msgpack
+import numpy as np
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from moshi.models.tts import script_to_entries
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+import app as service
+from audio_encoding import MIMETYPES
+from metrics import TIME_TO_FIRST_AUDIO, stage
+from tts_scheduler import Overloaded, decode_frames
+
+# How many 80ms chunks a streaming client may fall behind before its job is cancelled.
+STREAM_BUFFER_CHUNKS = int(os.getenv("STREAM_BUFFER_CHUNKS", 750))
+
+gpu_executor = ThreadPoolExecutor(
+    max_workers=len(service.pool.replicas), thread_name_prefix="tts-gpu"
+)
+
+
+class AsyncJobListener:
+    """Hands a scheduler job's chunks and completion to the event loop.
+
+    The scheduler thread must never block on one slow client, since that would
+    stall every row of the batch. Instead the client's backlog is bounded: once
+    it is `max_chunks` behind, the job is cancelled and the stream ends with an
+    error.
+    """
+
+    def __init__(self, loop, max_chunks=STREAM_BUFFER_CHUNKS):
+        self.loop = loop
+        self.max_chunks = max_chunks
+        self.queue = asyncio.Queue()
+        self.job = None
+        self.overflowed = False
+
+    def __call__(self, pcm):
+        self.loop.call_soon_threadsafe(self._put, pcm)
+
+    def _put(self, pcm):
+        if pcm is not None:
+            if self.overflowed:
+                return
+            if self.queue.qsize() >= self.max_chunks:
+                self.overflowed = True
+                self.job.cancel()
+                return
+        self.queue.put_nowait(pcm)
+
+    async def wait(self):
+        while await self.queue.get() is not None:
+            pass
+        return self.job.wait(0)
+
+    async def iter_pcm(self):
+        while (pcm := await self.queue.get()) is not None:
+            yield pcm
+        if self.overflowed:
+            raise RuntimeError("Client fell too far behind the audio stream")
+        if self.job.error is not None:
+            raise self.job.error
+
+
+def _prepare_voice(voice, cfg_coef):
+    replica = service.pool.route()
+    tts_scheduler = replica.get_scheduler()
+    tts_model = tts_scheduler.tts_model
+    condition = service.voice_condition(replica, tts_model, voice, cfg_coef)
+    return tts_scheduler, tts_model, condition
+
+
+def _prepare(text, voice, cfg_coef):
+    tts_scheduler, tts_model, condition = _prepare_voice(voice, cfg_coef)
+    entries = service.prepare_script(tts_model, text)
+    return tts_scheduler, tts_model, entries, condition
+
+
+def _overloaded_response(e):
+    return JSONResponse(
+        {"error": str(e), "retry_after": e.retry_after},
+        status_code=e.status,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def _decode(tts_model, frames):
+    with service.mimi_lock:
+        return decode_frames(tts_model.mimi, frames)
+
+
+async def _submit(text, voice, cfg_coef, n_q, priority, deadline, stream=False):
+    # `submit` is called on the loop thread, so the listener cannot see a
+    # chunk before `listener.job` is set.
+    loop = asyncio.get_running_loop()
+    tts_scheduler, tts_model, entries, condition = await loop.run_in_executor(
+        gpu_executor, _prepare, text, voice, cfg_coef
+    )
+    listener = AsyncJobListener(loop)
+    listener.job = tts_scheduler.submit(
+        entries,
+        condition.attributes,
+        condition.condition_tensors,
+        stream=stream,
+        listener=listener,
+        n_q=n_q,
+        priority=priority,
+        deadline=deadline,
+    )
+    return tts_model, listener
+
+
+async def tts(request):
+    start = time.perf_counter()
+    form = await request.form()
+    text = form.get("text", "")
+    voice = form.get("voice", service.DEFAULT_VOICE)
+    cfg_coef = float(form.get("cfg_coef", 2.0))
+    fmt = form.get("format", "wav")
+
+    if not text:
+        return JSONResponse({"error": "No text provided"}, status_code=400)
+    if fmt not in MIMETYPES:
+        return JSONResponse({"error": f"Unsupported format '{fmt}'"}, status_code=400)
+    try:
+        n_q, priority, deadline = service.request_options(form)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    try:
+        key = await run_in_threadpool(
+            service.phrase_cache_key, form, text, voice, cfg_coef, n_q
+        )
+        pcm = (
+            await run_in_threadpool(service.audio_cache.get, key)
+            if key is not None
+            else None
+        )
+        if pcm is None:
+            tts_model, listener = await _submit(
+                text, voice, cfg_coef, n_q, priority, deadline
+            )
+            frames = await listener.wait()
+            pcm = await asyncio.get_running_loop().run_in_executor(
+                gpu_executor, _decode, tts_model, frames
+            )
+            if key is not None:
+                await run_in_threadpool(service.audio_cache.put, key, pcm)
+        chunks, mimetype = service.encode_audio(pcm, service.SAMPLE_RATE, fmt)
+        TIME_TO_FIRST_AUDIO.labels("tts").observe(time.perf_counter() - start)
+        return StreamingResponse(chunks, media_type=mimetype)
+    except Overloaded as e:
+        return _overloaded_response(e)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def tts_stream(request):
+    start = time.perf_counter()
+    form = await request.form()
+    text = form.get("text", "")
+    voice = form.get("voice", service.DEFAULT_VOICE)
+    cfg_coef = float(form.get("cfg_coef", 2.0))
+
+    if not text:
+        return JSONResponse({"error": "No text"}, status_code=400)
+    try:
+        n_q, priority, deadline = service.request_options(form)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    # Submitted before the response starts, so a shed request gets its status code.
+    listener = None
+    try:
+        key = await run_in_threadpool(
+            service.phrase_cache_key, form, text, voice, cfg_coef, n_q
+        )
+        cached = (
+            await run_in_threadpool(service.audio_cache.get, key)
+            if key is not None
+            else None
+        )
+        if cached is None:
+            _, listener = await _submit(
+                text, voice, cfg_coef, n_q, priority, deadline, stream=True
+            )
+    except Overloaded as e:
+        return _overloaded_response(e)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    async def generate():
+        if cached is not None:
+            TIME_TO_FIRST_AUDIO.labels("tts_stream").observe(
+                time.perf_counter() - start
+            )
+            for chunk in service.iter_cached_pcm(cached):
+                yield chunk
+            return
+        try:
+            pcms = []
+            first = True
+            async for pcm in listener.iter_pcm():
+                if first:
+                    TIME_TO_FIRST_AUDIO.labels("tts_stream").observe(
+                        time.perf_counter() - start
+                    )
+                    first = False
+                if key is not None:
+                    pcms.append(pcm)
+                yield (pcm * 32767).astype(np.int16).tobytes()
+            if key is not None and not listener.job.cancelled:
+                pcm = np.concatenate(pcms) if pcms else np.zeros(0, dtype=np.float32)
+                await run_in_threadpool(service.audio_cache.put, key, pcm)
+        except Exception as e:
+            yield str(e).encode()
+        finally:
+            listener.job.cancel()
+
+    return StreamingResponse(generate(), media_type="audio/wav")
+
+
+async def tts_streaming(websocket):
+    """Incremental text in, PCM out, with the message schema of the Rust server's
+    `/api/tts_streaming`: the client sends msgpack `{"type": "Text", "text": ...}`
+    messages and a final `{"type": "Eos"}`, and receives `{"type": "Audio", "pcm": [...]}`
+    messages until the socket is closed after the last one."""
+    await websocket.accept()
+    voice = websocket.query_params.get("voice", service.DEFAULT_VOICE)
+    cfg_coef = float(websocket.query_params.get("cfg_coef", 2.0))
+    loop = asyncio.get_running_loop()
+    try:
+        n_q, priority, deadline = service.request_options(websocket.query_params)
+        tts_scheduler, tts_model, condition = await loop.run_in_executor(
+            gpu_executor, _prepare_voice, voice, cfg_coef
+        )
+    except Exception as e:
+        await websocket.send_bytes(msgpack.packb({"type": "Error", "message": str(e)}))
+        await websocket.close()
+        return
+
+    listener = AsyncJobListener(loop)
+    submitted = asyncio.Event()
+    pending = []
+
+    def submit(text_open):
+        listener.job = tts_scheduler.submit(
+            pending,
+            condition.attributes,
+            condition.condition_tensors,
+            stream=True,
+            listener=listener,
+            text_open=text_open,
+            n_q=n_q,
+            priority=priority,
+            deadline=deadline,
+        )
+        submitted.set()
+
+    async def receive_text():
+        first_turn = True
+        eos = False
+        async for message in websocket.iter_bytes():
+            msg = msgpack.unpackb(message)
+            if msg["type"] == "Eos":
+                eos = True
+                break
+            if msg["type"] != "Text" or not msg["text"].strip():
+                continue
+            with stage("prepare_script"):
+                entries = script_to_entries(
+                    tts_model.tokenizer,
+                    tts_model.machine.token_ids,
+                    tts_model.mimi.frame_rate,
+                    [msg["text"]],
+                    multi_speaker=first_turn and tts_model.multi_speaker,
+                    padding_between=1,
+                )
+            first_turn = False
+            if listener.job is not None:
+                listener.job.append_entries(entries)
+            else:
+                # Hold the job back until it has the lookahead the model needs,
+                # so it does not start by padding.
+                pending.extend(entries)
+                if len(pending) > tts_model.machine.second_stream_ahead:
+                    submit(text_open=True)
+        if not eos:
+            raise WebSocketDisconnect()
+        if listener.job is None:
+            submit(text_open=False)
+        else:
+            listener.job.close_text()
+
+    async def send_audio():
+        await submitted.wait()
+        async for pcm in listener.iter_pcm():
+            await websocket.send_bytes(
+                msgpack.packb({"type": "Audio", "pcm": pcm.tolist()})
+            )
+
+    receiver = asyncio.create_task(receive_text())
+    sender = asyncio.create_task(send_audio())
+    try:
+        await asyncio.gather(receiver, sender)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        await websocket.send_bytes(msgpack.packb({"type": "Error", "message": str(e)}))
+        await websocket.close()
+    finally:
+        # `gather` does not cancel the other task when one fails, and the
+        # sender never wakes up if the client left before the job started.
+        receiver.cancel()
+        sender.cancel()
+        if listener.job is not None:
+            listener.job.cancel()
+
+
+async def list_voices(request):
+    if len(service.voice_store):
+        voices = service.available_voices()
+    else:
+        voices = await run_in_threadpool(service.available_voices)
+    return JSONResponse({"voices": voices})
+
+
+async def gpu_status(request):
+    return JSONResponse(service.gpu_status_summary())
+
+
+@asynccontextmanager
+async def lifespan(_):
+    await asyncio.get_running_loop().run_in_executor(None, service.prepare_service)
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/api/tts", tts, methods=["POST"]),
+        Route("/api/tts/stream", tts_stream, methods=["POST"]),
+        WebSocketRoute("/api/tts_streaming", tts_streaming),
+        Route("/api/voices", list_voices),
+        Route("/api/gpu/status", gpu_status),
+        Mount("/", app=WSGIMiddleware(service.app)),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    # One process: the model replicas and their schedulers live in it.
+    uvicorn.run(app, host="0.0.0.0", port=service.PORT, workers=1)
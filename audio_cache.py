@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text, voice, cfg_coef, n_q, temp, seed, revision):
+    """Content address of one synthesized phrase."""
+    fields = {
+        "text": normalize_text(text),
+        "voice": voice,
+        "cfg_coef": float(cfg_coef),
+        "n_q": int(n_q),
+        "temp": float(temp),
+        "seed": None if seed is None else str(seed),
+        "revision": revision,
+    }
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+class PhraseAudioCache:
+    """Two-tier LRU cache of synthesized PCM, keyed by `cache_key`.
+
+    The memory tier holds float32 arrays up to `memory_bytes`. Every entry is
+    also written as a `.npy` file to `disk_dir`, bounded by `disk_bytes`, so the
+    cache outlives memory evictions and restarts; a disk hit is promoted back to
+    memory. Either tier is disabled by a zero budget.
+    """
+
+    def __init__(self, memory_bytes=256 * 1024**2, disk_dir=None, disk_bytes=0):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir if disk_bytes > 0 else None
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.disk = OrderedDict()
+        self.memory_used = 0
+        self.disk_used = 0
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.disk_dir is not None:
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        os.makedirs(self.disk_dir, exist_ok=True)
+        files = []
+        for filename in os.listdir(self.disk_dir):
+            if filename.endswith(".npy"):
+                st = os.stat(os.path.join(self.disk_dir, filename))
+                files.append((st.st_mtime, filename[: -len(".npy")], st.st_size))
+        # Oldest first, so the OrderedDict is in LRU order.
+        for _, key, size in sorted(files):
+            self.disk[key] = size
+            self.disk_used += size
+        self._evict_disk()
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.npy")
+
+    def get(self, key):
+        with self.lock:
+            pcm = self.memory.get(key)
+            if pcm is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return pcm
+            on_disk = key in self.disk
+            if on_disk:
+                self.disk.move_to_end(key)
+        if on_disk:
+            try:
+                pcm = np.load(self._path(key))
+                os.utime(self._path(key))
+            except OSError:
+                pcm = None
+            if pcm is not None:
+                with self.lock:
+                    self.disk_hits += 1
+                    self._put_memory(key, pcm)
+                return pcm
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, pcm):
+        pcm = np.ascontiguousarray(pcm, dtype=np.float32)
+        if self.disk_dir is not None and pcm.nbytes <= self.disk_bytes:
+            try:
+                self._put_disk(key, pcm)
+            except OSError as e:
+                # The audio was synthesized fine; a failed cache write only
+                # costs a future hit.
+                print(f"⚠️  Audio cache write failed for {key}: {e}")
+        with self.lock:
+            self._put_memory(key, pcm)
+
+    def _put_disk(self, key, pcm):
+        # Concurrent misses on the same phrase each write their own temp file;
+        # the last `os.replace` wins, and any of them is a valid take for the key.
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f"{key}.", suffix=".tmp", dir=self.disk_dir
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, pcm)
+                size = f.tell()
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        with self.lock:
+            self.disk_used += size - self.disk.pop(key, 0)
+            self.disk[key] = size
+            self._evict_disk()
+
+    def _put_memory(self, key, pcm):
+        if pcm.nbytes > self.memory_bytes:
+            return
+        if key in self.memory:
+            self.memory_used -= self.memory.pop(key).nbytes
+        self.memory[key] = pcm
+        self.memory_used += pcm.nbytes
+        while self.memory_used > self.memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= evicted.nbytes
+            self.evictions += 1
+
+    def _evict_disk(self):
+        while self.disk_used > self.disk_bytes and self.disk:
+            key, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_used = 0
+            keys = list(self.disk)
+            self.disk.clear()
+            self.disk_used = 0
+        for key in keys:
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            total = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_used,
+                "memory_max_bytes": self.memory_bytes,
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_used,
+                "disk_max_bytes": self.disk_bytes if self.disk_dir is not None else 0,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / total, 4)
+                if total
+                else 0.0,
+            }
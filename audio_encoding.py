@@ -0,0 +1,70 @@
+import struct
+
+import numpy as np
+import sphn
+
+CHUNK_BYTES = 64 * 1024
+MIMETYPES = {"wav": "audio/wav", "opus": "audio/ogg"}
+
+
+def wav_header(sample_rate, num_samples=None, channels=1):
+    """RIFF header for 16-bit PCM. With `num_samples=None` the sizes are set to
+    the maximum value, which players accept for streams of unknown length."""
+    block_align = channels * 2
+    if num_samples is None:
+        data_size = 0xFFFFFFFF - 36
+    else:
+        data_size = num_samples * block_align
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        channels,
+        sample_rate,
+        sample_rate * block_align,
+        block_align,
+        16,
+        b"data",
+        data_size,
+    )
+
+
+def pcm_to_int16(pcm):
+    return (np.clip(pcm, -1, 1) * 32767).astype("<i2")
+
+
+def encode_wav(pcm, sample_rate):
+    return wav_header(sample_rate, len(pcm)) + pcm_to_int16(pcm).tobytes()
+
+
+def iter_wav(pcm, sample_rate, chunk_bytes=CHUNK_BYTES):
+    yield wav_header(sample_rate, len(pcm))
+    data = memoryview(pcm_to_int16(pcm).tobytes())
+    for start in range(0, len(data), chunk_bytes):
+        yield bytes(data[start : start + chunk_bytes])
+
+
+def encode_opus(pcm, sample_rate):
+    # Opus works on 20 ms frames, pad the tail so the last one is not dropped.
+    frame = sample_rate // 50
+    pcm = np.asarray(pcm, dtype=np.float32)
+    if len(pcm) % frame:
+        pcm = np.pad(pcm, (0, frame - len(pcm) % frame))
+    writer = sphn.OpusStreamWriter(sample_rate)
+    writer.append_pcm(pcm)
+    return writer.read_bytes()
+
+
+def iter_encoded(pcm, sample_rate, fmt="wav"):
+    """Return `(chunks, mimetype)` for a response body in the requested format."""
+    if fmt not in MIMETYPES:
+        raise ValueError(
+            f"Unsupported format '{fmt}', expected one of {sorted(MIMETYPES)}"
+        )
+    if fmt == "opus":
+        return iter([encode_opus(pcm, sample_rate)]), MIMETYPES[fmt]
+    return iter_wav(pcm, sample_rate), MIMETYPES[fmt]
@@ -1,22 +1,167 @@
+import bisect
+import os
 import threading
+import time
 import torch
 
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def to_dict(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'buckets': buckets, 'sum': round(self.sum, 4), 'count': self.count}
+
+def _modules(model):
+    if isinstance(model, torch.nn.Module):
+        return [model]
+    return [v for v in vars(model).values() if isinstance(v, torch.nn.Module)]
+
+def _move(model, device, pin=False):
+    for module in _modules(model):
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            if pin:
+                data = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+                data.copy_(tensor.data, non_blocking=True)
+            else:
+                data = tensor.data.to(device, non_blocking=True)
+            tensor.data = data
+    torch.cuda.synchronize()
+
 class GPUManager:
-    def __init__(self):
+    """Owns the resident model and moves it between three states.
+
+    - resident: weights on the GPU, ready to serve.
+    - standby: weights parked in pinned host memory, reloading is a plain
+      host-to-device copy.
+    - cold: no model, the next `get_model` runs the full `load_func`.
+
+    With `idle_timeout` set, a background watcher moves a resident model to
+    standby once nothing has used it for that many seconds.
+    """
+
+    def __init__(self, idle_timeout=0.0, device='cuda'):
         self.model = None
+        self.state = 'cold'
+        self.device = device
         self.lock = threading.Lock()
+        self.idle_timeout = idle_timeout
+        self.last_used = time.monotonic()
+        self.load_latency = {'cold': LatencyHistogram(), 'standby': LatencyHistogram()}
+        self.load_count = 0
+        self.offload_count = 0
+        self.offload_callbacks = []
+        self.busy_checks = []
+        self.draining = False
+        if idle_timeout > 0:
+            threading.Thread(target=self._watch, name='gpu-idle-watcher', daemon=True).start()
 
     def get_model(self, load_func):
         with self.lock:
-            if self.model is None:
+            self.last_used = time.monotonic()
+            if self.state == 'resident':
+                return self.model
+            start = time.perf_counter()
+            if self.state == 'standby':
+                _move(self.model, self.device)
+            else:
                 self.model = load_func()
+            self.load_latency[self.state].observe(time.perf_counter() - start)
+            self.load_count += 1
+            self.state = 'resident'
             return self.model
 
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def offload(self, idle_only=False):
+        """Park the model in pinned host memory, keeping it warm for a fast reload."""
+        with self.lock:
+            if self.state != 'resident' or not str(self.device).startswith('cuda'):
+                return False
+            # Re-checked under the lock: a request may have grabbed the model
+            # since the watcher last looked.
+            if idle_only and (self._is_busy() or time.monotonic() - self.last_used <= self.idle_timeout):
+                return False
+            self._run_offload_callbacks()
+            _move(self.model, 'cpu', pin=True)
+            self.state = 'standby'
+            self.offload_count += 1
+            torch.cuda.empty_cache()
+            return True
+
     def force_offload(self):
         with self.lock:
             if self.model is not None:
+                self._run_offload_callbacks()
                 del self.model
                 self.model = None
+                self.state = 'cold'
+                self.offload_count += 1
                 torch.cuda.empty_cache()
 
-gpu_manager = GPUManager()
+    def drain(self, mode='standby'):
+        """Stop taking new work (see `draining`) and offload once in-flight work is done."""
+        self.draining = True
+
+        def _wait_and_offload():
+            while self._is_busy():
+                time.sleep(0.1)
+            if mode == 'cold':
+                self.force_offload()
+            else:
+                self.offload()
+
+        threading.Thread(target=_wait_and_offload, name='gpu-drain', daemon=True).start()
+
+    def resume(self):
+        self.draining = False
+
+    def _run_offload_callbacks(self):
+        for callback in self.offload_callbacks:
+            callback()
+
+    def _is_busy(self):
+        return any(check() for check in self.busy_checks)
+
+    def _watch(self):
+        while True:
+            time.sleep(min(self.idle_timeout, 5.0))
+            if self.state != 'resident':
+                continue
+            if self._is_busy():
+                self.touch()
+            elif time.monotonic() - self.last_used > self.idle_timeout:
+                if self.offload(idle_only=True):
+                    print(f"💤 GPU idle for {self.idle_timeout:.0f}s, model moved to standby")
+
+    def status(self):
+        return {
+            'state': self.state,
+            'device': str(self.device),
+            'draining': self.draining,
+            'idle_timeout': self.idle_timeout,
+            'idle_seconds': round(time.monotonic() - self.last_used, 1),
+            'load_count': self.load_count,
+            'offload_count': self.offload_count,
+            'load_latency_seconds': {k: v.to_dict() for k, v in self.load_latency.items()},
+        }
+
+# One manager per model replica, e.g. DEVICES=cuda:0,cuda:1 (or cpu,cpu for testing).
+DEVICES = [d.strip() for d in os.getenv('DEVICES', os.getenv('DEVICE', 'cuda')).split(',') if d.strip()]
+gpu_managers = [GPUManager(idle_timeout=float(os.getenv('GPU_IDLE_TIMEOUT', 60)), device=device) for device in DEVICES]
+gpu_manager = gpu_managers[0]
@@ -0,0 +1,70 @@
+import re
+
+import numpy as np
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?;:。！？；])\s+")
+
+
+def split_segments(text, max_chars=400):
+    """Split text into segments of whole sentences, at most `max_chars` long.
+
+    Paragraph breaks always end a segment. A single sentence longer than
+    `max_chars` is kept whole rather than cut mid-sentence.
+    """
+    segments = []
+    for paragraph in _PARAGRAPH_RE.split(text):
+        current = ""
+        for sentence in _SENTENCE_RE.split(paragraph.strip()):
+            sentence = " ".join(sentence.split())
+            if not sentence:
+                continue
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                segments.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            segments.append(current)
+    return segments
+
+
+def stitch(pcms, sample_rate, silence=0.3, crossfade=0.05):
+    """Join segment PCM into one signal.
+
+    With `silence` > 0 segments are separated by that much silence, and
+    `crossfade` is used as a fade-out/fade-in at each seam to avoid clicks.
+    With `silence` == 0 adjacent segments are overlapped by `crossfade`.
+    Returns the signal and the (start, end) time of each segment in it.
+    """
+    fade = int(crossfade * sample_rate)
+    gap = np.zeros(int(silence * sample_rate), dtype=np.float32)
+    pieces = []
+    length = 0
+    spans = []
+    for i, pcm in enumerate(pcms):
+        pcm = np.asarray(pcm, dtype=np.float32).copy()
+        n = min(fade, len(pcm) // 2)
+        if i > 0 and n > 0:
+            pcm[:n] *= np.linspace(0, 1, n, dtype=np.float32)
+        if i < len(pcms) - 1 and n > 0 and len(gap):
+            pcm[-n:] *= np.linspace(1, 0, n, dtype=np.float32)
+        if i > 0 and not len(gap) and 0 < n <= len(pieces[-1]):
+            # Overlap-add: the tail of the previous segment fades out while
+            # this one fades in.
+            previous = pieces[-1]
+            previous[-n:] *= np.linspace(1, 0, n, dtype=np.float32)
+            previous[-n:] += pcm[:n]
+            start = length - n
+            pcm = pcm[n:]
+        else:
+            if i > 0 and len(gap):
+                pieces.append(gap)
+                length += len(gap)
+            start = length
+        pieces.append(pcm)
+        length += len(pcm)
+        spans.append((start / sample_rate, length / sample_rate))
+    if not pieces:
+        return np.zeros(0, dtype=np.float32), spans
+    return np.concatenate(pieces), spans
@@ -1,11 +1,14 @@
 from fastmcp import FastMCP
+import dataclasses
 import torch
-import numpy as np
 import sphn
 import tempfile
 from moshi.models.loaders import CheckpointInfo
 from moshi.models.tts import DEFAULT_DSM_TTS_REPO, DEFAULT_DSM_TTS_VOICE_REPO, TTSModel
 from gpu_manager import gpu_manager
+from quality import DEFAULT_QUALITY, MAX_N_Q, quality_n_q
+from tts_scheduler import decode_frames
+from voice_cache import VoiceConditionCache
 import os
 
 mcp = FastMCP("Kyutai-TTS")
@@ -14,17 +17,20 @@ DEVICE = os.getenv('DEVICE', 'cuda')
 HF_REPO = os.getenv('HF_REPO', DEFAULT_DSM_TTS_REPO)
 VOICE_REPO = os.getenv('VOICE_REPO', DEFAULT_DSM_TTS_VOICE_REPO)
 DEFAULT_VOICE = 'expresso/ex03-ex01_happy_001_channel1_334s.wav'
+voice_cache = VoiceConditionCache(max_bytes=int(os.getenv('VOICE_CACHE_MB', 256)) * 1024**2)
+gpu_manager.offload_callbacks.append(voice_cache.clear)
 
 def load_model():
     checkpoint_info = CheckpointInfo.from_hf_repo(HF_REPO)
-    return TTSModel.from_checkpoint_info(checkpoint_info, n_q=32, temp=0.6, device=DEVICE)
+    return TTSModel.from_checkpoint_info(checkpoint_info, n_q=MAX_N_Q, temp=0.6, device=DEVICE)
 
 @mcp.tool()
 def text_to_speech(
     text: str,
     output_path: str,
     voice: str = DEFAULT_VOICE,
-    cfg_coef: float = 2.0
+    cfg_coef: float = 2.0,
+    quality: str = DEFAULT_QUALITY
 ) -> dict:
     """
     Convert text to speech using Kyutai TTS
@@ -34,24 +40,20 @@ def text_to_speech(
         output_path: Path to save the audio file (must end with .wav)
         voice: Voice name (default: expresso/ex03-ex01_happy_001_channel1_334s.wav)
         cfg_coef: CFG coefficient (1.0-3.0, default: 2.0)
+        quality: fast, balanced or best (fewer audio codebooks is faster)
     
     Returns:
         Result dictionary with status and output path
     """
     try:
+        n_q = quality_n_q(quality)
         tts_model = gpu_manager.get_model(load_model)
         entries = tts_model.prepare_script([text], padding_between=1)
         voice_path = tts_model.get_voice_path(voice) if not voice.endswith('.safetensors') else voice
-        condition_attributes = tts_model.make_condition_attributes([voice_path], cfg_coef=cfg_coef)
+        condition = voice_cache.get(tts_model, voice_path, cfg_coef)
         
-        result = tts_model.generate([entries], [condition_attributes])
-        
-        with tts_model.mimi.streaming(1), torch.no_grad():
-            pcms = []
-            for frame in result.frames[tts_model.delay_steps:]:
-                pcm = tts_model.mimi.decode(frame[:, 1:, :]).cpu().numpy()
-                pcms.append(np.clip(pcm[0, 0], -1, 1))
-            pcm = np.concatenate(pcms, axis=-1)
+        result = dataclasses.replace(tts_model, n_q=n_q).generate([entries], [condition.attributes])
+        pcm = decode_frames(tts_model.mimi, result.frames[tts_model.delay_steps:])
         
         sphn.write_wav(output_path, pcm, tts_model.mimi.sample_rate)
         
@@ -74,9 +76,11 @@ def get_gpu_status() -> dict:
     if torch.cuda.is_available():
         return {
             'available': True,
-            'model_loaded': gpu_manager.model is not None,
+            'model_loaded': gpu_manager.state == 'resident',
+            'state': gpu_manager.state,
             'memory_used_gb': round(torch.cuda.memory_allocated() / 1024**3, 2),
-            'memory_total_gb': round(torch.cuda.get_device_properties(0).total_memory / 1024**3, 2)
+            'memory_total_gb': round(torch.cuda.get_device_properties(0).total_memory / 1024**3, 2),
+            'voice_cache': voice_cache.stats()
         }
     return {'available': False}
 
@@ -0,0 +1,166 @@
+"""Prometheus metrics of the TTS service, exported on `/metrics`.
+
+Stage histograms are observed where the work happens (pool, scheduler,
+decoder, encoder); per-replica state that already lives on the GPU managers
+is read at scrape time by `ReplicaCollector`.
+"""
+
+import time
+
+import torch
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import (
+    CounterMetricFamily,
+    GaugeMetricFamily,
+    HistogramMetricFamily,
+)
+
+STAGE_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+STEP_BUCKETS = (0.005, 0.01, 0.02, 0.03, 0.04, 0.06, 0.08, 0.1, 0.15, 0.25, 0.5, 1.0)
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+
+STAGE_SECONDS = Histogram(
+    "tts_stage_seconds",
+    "Time spent in each request stage: queue_wait, get_model, prepare_script, "
+    "conditioning, generate, decode, encode",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+STEP_SECONDS = Histogram(
+    "tts_step_seconds",
+    "Duration of one batched scheduler step (model: lm or the streaming mimi decode)",
+    ["model"],
+    buckets=STEP_BUCKETS,
+)
+TIME_TO_FIRST_AUDIO = Histogram(
+    "tts_time_to_first_audio_seconds",
+    "From request arrival to the first audio bytes being ready",
+    ["endpoint"],
+    buckets=STAGE_BUCKETS,
+)
+REAL_TIME_FACTOR = Histogram(
+    "tts_real_time_factor",
+    "Generation time of a job divided by the duration of its audio",
+    buckets=RTF_BUCKETS,
+)
+JOBS = Counter(
+    "tts_jobs",
+    "Jobs submitted to the schedulers, by number of audio codebooks",
+    ["n_q"],
+)
+SHED = Counter("tts_shed", "Jobs rejected by admission control", ["priority", "reason"])
+TIER_SWITCHES = Counter(
+    "tts_tier_switches",
+    "Batches rebuilt to serve a different number of audio codebooks",
+)
+
+
+def stage(name):
+    """Context manager timing one stage, e.g. `with stage('decode'): ...`."""
+    return STAGE_SECONDS.labels(name).time()
+
+
+def timed_iter(chunks, name, elapsed=0.0):
+    """Yield from `chunks`, observing the total time spent producing them (plus
+    `elapsed`, for work done up front) once exhausted."""
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            break
+        finally:
+            elapsed += time.perf_counter() - start
+        yield chunk
+    STAGE_SECONDS.labels(name).observe(elapsed)
+
+
+class ReplicaCollector:
+    """Scrape-time view of the replicas: model loads/offloads and GPU memory."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def collect(self):
+        loads = CounterMetricFamily(
+            "tts_model_loads",
+            "Model loads onto the device",
+            labels=["replica", "source"],
+        )
+        offloads = CounterMetricFamily(
+            "tts_model_offloads", "Model offloads from the device", labels=["replica"]
+        )
+        load_seconds = HistogramMetricFamily(
+            "tts_model_load_seconds",
+            "Time to make the model resident",
+            labels=["replica", "source"],
+        )
+        memory = GaugeMetricFamily(
+            "tts_gpu_memory_allocated_bytes",
+            "Current GPU memory allocated",
+            labels=["replica"],
+        )
+        memory_peak = GaugeMetricFamily(
+            "tts_gpu_memory_peak_bytes",
+            "Peak GPU memory allocated since start",
+            labels=["replica"],
+        )
+        queue_depth = GaugeMetricFamily(
+            "tts_queue_depth",
+            "Jobs waiting for a batch slot",
+            labels=["replica", "priority"],
+        )
+        batch_active = GaugeMetricFamily(
+            "tts_batch_active", "Jobs in the running batch", labels=["replica"]
+        )
+        for replica in self.pool.replicas:
+            index = str(replica.index)
+            manager = replica.manager
+            for source, histogram in manager.load_latency.items():
+                loads.add_metric([index, source], histogram.count)
+                cumulative = 0
+                buckets = []
+                for bound, count in zip(
+                    list(histogram.buckets) + ["+Inf"], histogram.counts
+                ):
+                    cumulative += count
+                    buckets.append((str(bound), cumulative))
+                load_seconds.add_metric([index, source], buckets, histogram.sum)
+            offloads.add_metric([index], manager.offload_count)
+            scheduler = replica.scheduler
+            if scheduler is not None:
+                for priority, depth in scheduler.queue_depth_by_priority().items():
+                    queue_depth.add_metric([index, priority], depth)
+            batch_active.add_metric(
+                [index], scheduler.active if scheduler is not None else 0
+            )
+            if str(replica.device).startswith("cuda") and torch.cuda.is_available():
+                device = torch.device(replica.device)
+                memory.add_metric([index], torch.cuda.memory_allocated(device))
+                memory_peak.add_metric([index], torch.cuda.max_memory_allocated(device))
+        return [
+            loads,
+            offloads,
+            load_seconds,
+            memory,
+            memory_peak,
+            queue_depth,
+            batch_active,
+        ]
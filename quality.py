@@ -0,0 +1,30 @@
+import os
+
+
+def parse_tiers(spec):
+    """Parse `name:n_q` pairs, e.g. `fast:8,balanced:24,best:32`."""
+    tiers = {}
+    for item in spec.split(","):
+        name, n_q = item.split(":")
+        tiers[name.strip()] = int(n_q)
+    return tiers
+
+
+# Audio codebooks generated per quality tier. Each codebook is one depformer
+# step per frame and one more RVQ level for Mimi to decode; 8-32 are
+# reasonable values, fewer is faster at some cost in fidelity.
+QUALITY_TIERS = parse_tiers(
+    os.getenv("TTS_QUALITY_TIERS", "fast:8,balanced:24,best:32")
+)
+DEFAULT_QUALITY = os.getenv("DEFAULT_QUALITY", "best")
+# The model is loaded for the largest tier; smaller ones run on the same weights.
+MAX_N_Q = max(QUALITY_TIERS.values())
+
+
+def quality_n_q(quality=None):
+    quality = quality or DEFAULT_QUALITY
+    if quality not in QUALITY_TIERS:
+        raise ValueError(
+            f"Unknown quality '{quality}', expected one of {sorted(QUALITY_TIERS)}"
+        )
+    return QUALITY_TIERS[quality]
@@ -0,0 +1,83 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "numpy",
+#     "sphn",
+# ]
+# ///
+"""Compare the old temp-file WAV response path against in-memory encoding.
+
+Runs without a model: the input is synthetic 24kHz PCM of the given duration.
+Run from the repository root so that `audio_encoding` can be imported.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import sphn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from audio_encoding import iter_encoded  # noqa: E402
+
+SAMPLE_RATE = 24000
+
+
+def temp_file_wav(pcm):
+    # What `/api/tts` used to do: write through sphn to /tmp, then read it back.
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
+        sphn.write_wav(f.name, pcm, SAMPLE_RATE)
+    with open(f.name, "rb") as fobj:
+        body = fobj.read()
+    os.unlink(f.name)
+    return body
+
+
+def in_memory(fmt):
+    def _encode(pcm):
+        chunks, _ = iter_encoded(pcm, SAMPLE_RATE, fmt)
+        return b"".join(chunks)
+
+    return _encode
+
+
+def run(name, encode, pcm, iterations):
+    latencies = []
+    total_bytes = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        body = encode(pcm)
+        latencies.append(time.perf_counter() - start)
+        total_bytes += len(body)
+    latencies = np.array(latencies)
+    print(
+        f"{name:>10}: {total_bytes / latencies.sum() / 1e6:8.1f} MB/s  "
+        f"p50 {1000 * np.percentile(latencies, 50):7.2f}ms  "
+        f"p99 {1000 * np.percentile(latencies, 99):7.2f}ms  "
+        f"size {total_bytes / iterations / 1024:8.1f}KB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--seconds", type=float, default=10.0, help="Audio duration per response."
+    )
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    pcm = (0.1 * rng.standard_normal(int(args.seconds * SAMPLE_RATE))).astype(
+        np.float32
+    )
+
+    run("tempfile", temp_file_wav, pcm, args.iterations)
+    run("wav", in_memory("wav"), pcm, args.iterations)
+    run("opus", in_memory("opus"), pcm, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "moshi==0.2.11",
+#     "numpy",
+#     "torch",
+# ]
+# ///
+"""Steps per second of the streaming LMGen loop: eager vs. static buffers vs. compiled.
+
+By default the model is a small randomly initialized LM with the same layout as
+the TTS model (text stream + `n_q` depformer codebooks, no user audio), so the
+benchmark runs on CPU in CI. Sizes can be raised towards the real model with
+the flags below. Run from the repository root so that `tts_step` can be
+imported.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+from moshi.models.lm import LMGen, LMModel
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from tts_step import compile_lm_gen  # noqa: E402
+
+FRAME_RATE = 12.5
+
+
+def make_lm(args):
+    return LMModel(
+        delays=[0] + [1] * args.n_q,
+        n_q=args.n_q,
+        dep_q=args.n_q,
+        card=args.card,
+        text_card=args.text_card,
+        dim=args.dim,
+        num_heads=args.num_heads,
+        num_layers=args.num_layers,
+        hidden_scale=4.125,
+        context=args.context,
+        causal=True,
+        layer_scale=None,
+        gating="silu",
+        norm="rms_norm_f32",
+        positional_embedding="rope",
+        max_period=10000,
+        depformer_dim=args.depformer_dim,
+        depformer_num_heads=args.num_heads,
+        depformer_num_layers=args.depformer_num_layers,
+        depformer_layer_scale=None,
+        depformer_multi_linear=True,
+        depformer_context=args.n_q,
+        depformer_max_period=10000,
+        depformer_gating="silu",
+        depformer_pos_emb="none",
+        depformer_weights_per_step=True,
+        existing_text_padding_id=3,
+        device=args.device,
+    ).eval()
+
+
+@torch.no_grad()
+def run(name, lm, args, static, compile):
+    lm_gen = LMGen(lm, temp=0.6, temp_text=0.6)
+    shape = (args.batch_size, lm.n_q - lm.dep_q, 1)
+    input_tokens = torch.full(
+        shape, lm.zero_token_id, dtype=torch.long, device=lm.device
+    )
+    with lm_gen.streaming(args.batch_size):
+        if compile:
+            compile_lm_gen(lm_gen)
+
+        def step():
+            if static:
+                tokens = input_tokens
+            else:
+                # What `TTSGen._step` used to do on every step.
+                tokens = torch.full(
+                    shape, lm.zero_token_id, dtype=torch.long, device=lm.device
+                )
+            lm_gen.step(tokens)
+
+        for _ in range(args.warmup):
+            step()
+        if lm.device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            step()
+        if lm.device.type == "cuda":
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start
+    steps_per_sec = args.steps / elapsed
+    print(
+        f"{name:>9}: {steps_per_sec:8.1f} steps/s  "
+        f"{1000 / steps_per_sec:7.2f}ms/step  "
+        f"RTF x{steps_per_sec / FRAME_RATE:6.2f} per stream"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--n-q", type=int, default=8)
+    parser.add_argument("--card", type=int, default=2048)
+    parser.add_argument("--text-card", type=int, default=8000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--num-heads", type=int, default=4)
+    parser.add_argument("--num-layers", type=int, default=4)
+    parser.add_argument("--depformer-dim", type=int, default=128)
+    parser.add_argument("--depformer-num-layers", type=int, default=2)
+    parser.add_argument("--context", type=int, default=500)
+    parser.add_argument(
+        "--no-compile", action="store_true", help="Skip the torch.compile run."
+    )
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    lm = make_lm(args)
+    run("eager", lm, args, static=False, compile=False)
+    run("static", lm, args, static=True, compile=False)
+    if not args.no_compile:
+        run("compiled", lm, args, static=True, compile=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,12 @@
 Example implementation of the streaming STT example. Here we group
 test utterances in batches (pre- and post-padded with silence) and
 and then feed these batches into the streaming STT model frame-by-frame.
+
+Utterances are bucketed by duration, longest first, so that a batch holds
+utterances of similar length, and a batch is capped both by `--batch-size`
+and by `--max-batch-frames` (rows times the longest row, in model steps).
+Rows that reach their end stop executing while the rest of the batch runs,
+and the share of row-steps still spent on padding is reported next to the RTF.
 """
 
 # The outputs I get on my H100 using this code with the 2.6B model,
@@ -35,14 +41,17 @@ and then feed these batches into the streaming STT model frame-by-frame.
 
 import argparse
 import dataclasses
+import io
+import math
 import time
 
 import jiwer
 import julius
 import moshi.models
+import soundfile
 import torch
 import tqdm
-from datasets import Dataset, load_dataset
+from datasets import Audio, Dataset, load_dataset
 from whisper.normalizers import EnglishTextNormalizer
 
 _NORMALIZER = EnglishTextNormalizer()
@@ -200,6 +209,51 @@ def get_dataset(args) -> Dataset:
     return dataset
 
 
+def get_durations(dataset) -> list[float]:
+    """Duration in seconds of every utterance, read from the audio file headers
+    so that nothing is decoded."""
+    raw = dataset.select_columns(["audio"]).cast_column("audio", Audio(decode=False))
+    durations = []
+    for batch in raw.iter(256):
+        for audio in batch["audio"]:
+            if audio["bytes"] is not None:
+                info = soundfile.info(io.BytesIO(audio["bytes"]))
+            else:
+                info = soundfile.info(audio["path"])
+            durations.append(info.frames / info.samplerate)
+    return durations
+
+
+def bucket_batches(
+    lengths: list[int], batch_size: int, max_batch_frames: int | None
+) -> list[list[int]]:
+    """Group utterance indexes into batches of similar length.
+
+    Indexes are taken longest first, so the first row of a batch is its longest
+    and sets its padded length; a batch is closed once it has `batch_size` rows
+    or another row would take it over `max_batch_frames` total steps. An
+    utterance longer than the budget gets a batch of its own. Starting with the
+    longest batches also surfaces out-of-memory errors right away.
+    """
+    order = sorted(range(len(lengths)), key=lambda index: lengths[index], reverse=True)
+    batches = []
+    batch = []
+    for index in order:
+        if batch and (
+            len(batch) == batch_size
+            or (
+                max_batch_frames
+                and (len(batch) + 1) * lengths[batch[0]] > max_batch_frames
+            )
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
 @torch.no_grad
 def get_padded_batch(
     audios: list[tuple[torch.Tensor, int]],
@@ -232,7 +286,9 @@ def get_padded_batch(
             for audio in batch
         ]
     )
-    return padded_batch
+    # Model steps each row needs, including its own silence padding.
+    steps = [math.ceil(audio.shape[-1] / audio_encoder.frame_size) for audio in batch]
+    return padded_batch, steps
 
 
 @torch.no_grad
@@ -240,13 +296,25 @@ def streaming_transcribe(
     padded_batch: torch.Tensor,
     mimi,
     lm_gen,
+    steps: list[int] | None = None,
 ):
     bsz = padded_batch.shape[0]
 
     text_tokens_acc = []
+    # Once a row has had all its steps it stops executing: its state is frozen
+    # and it only outputs ungenerated tokens, which are dropped with padding.
+    ends = {}
+    for row, row_steps in enumerate(steps or []):
+        ends.setdefault(row_steps, []).append(row)
+    active = torch.ones(bsz, dtype=torch.bool, device=padded_batch.device)
 
     with mimi.streaming(bsz), lm_gen.streaming(bsz):
-        for offset in range(0, padded_batch.shape[-1], mimi.frame_size):
+        for step, offset in enumerate(
+            range(0, padded_batch.shape[-1], mimi.frame_size)
+        ):
+            if step in ends:
+                active[ends[step]] = False
+                lm_gen.set_exec_mask(active)
             audio_chunk = padded_batch[:, offset : offset + mimi.frame_size]
             audio_chunk = audio_chunk[:, None, :]
 
@@ -266,12 +334,32 @@ def run_inference(
     padding_token_id,
     before_padding_sec,
     after_padding_sec,
+    batch_size,
+    max_batch_frames=None,
+    bucketing=True,
 ):
     metrics = AsrMetrics()
     audio_time = 0.0
     inference_timer = Timer()
+    useful_steps = 0
+    total_steps = 0
+
+    if bucketing:
+        lengths = [
+            math.ceil(
+                (duration + before_padding_sec + after_padding_sec) * mimi.frame_rate
+            )
+            for duration in get_durations(dataset)
+        ]
+        buckets = bucket_batches(lengths, batch_size, max_batch_frames)
+        # Lazily, so only one batch of audio is decoded and held at a time.
+        batches = (dataset[indexes] for indexes in buckets)
+        num_batches = len(buckets)
+    else:
+        batches = dataset.iter(batch_size)
+        num_batches = math.ceil(len(dataset) / batch_size)
 
-    for batch in tqdm.tqdm(dataset.iter(args.batch_size)):
+    for batch in tqdm.tqdm(batches, total=num_batches):
         audio_data = list(
             zip(
                 [torch.tensor(x["array"]).float() for x in batch["audio"]],
@@ -283,19 +371,22 @@ def run_inference(
 
         gt_transcripts = batch["original_text"]
 
-        padded_batch = get_padded_batch(
+        padded_batch, steps = get_padded_batch(
             audio_data,
             before_padding=before_padding_sec,
             after_padding=after_padding_sec,
             audio_encoder=mimi,
         )
         padded_batch = padded_batch.cuda()
+        useful_steps += sum(steps)
+        total_steps += len(steps) * max(steps)
 
         with inference_timer:
             text_tokens = streaming_transcribe(
                 padded_batch,
                 mimi=mimi,
                 lm_gen=lm_gen,
+                steps=steps,
             )
 
         for batch_index in range(text_tokens.shape[0]):
@@ -304,7 +395,8 @@ def run_inference(
             text = tokenizer.decode(utterance_tokens.cpu().numpy().tolist())
             metrics.update(hyp=text, ref=gt_transcripts[batch_index])
 
-    return metrics, inference_timer.total, audio_time
+    padding_waste = 1 - useful_steps / total_steps if total_steps else 0.0
+    return metrics, inference_timer.total, audio_time, padding_waste
 
 
 def main(args):
@@ -334,7 +426,7 @@ def main(args):
     )
     audio_delay_seconds = info.stt_config.get("audio_delay_seconds", 5.0)
 
-    wer_metric, inference_time, audio_time = run_inference(
+    wer_metric, inference_time, audio_time, padding_waste = run_inference(
         dataset,
         mimi,
         lm_gen,
@@ -342,9 +434,16 @@ def main(args):
         padding_token_id,
         audio_silence_prefix_seconds,
         audio_delay_seconds + 0.5,
+        batch_size=args.batch_size,
+        max_batch_frames=args.max_batch_frames,
+        bucketing=not args.no_bucketing,
     )
 
-    print(wer_metric, f"RTF = {audio_time / inference_time:.2f}")
+    print(
+        wer_metric,
+        f"RTF = {audio_time / inference_time:.2f}",
+        f"padding = {100 * padding_waste:.1f}%",
+    )
 
 
 if __name__ == "__main__":
@@ -375,6 +474,18 @@ if __name__ == "__main__":
         help="Batch size.",
         default=32,
     )
+    parser.add_argument(
+        "--max-batch-frames",
+        type=int,
+        default=None,
+        help="Cap on rows times the longest row of a batch, in model steps "
+        "(12.5 per second of audio). Defaults to no cap beyond --batch-size.",
+    )
+    parser.add_argument(
+        "--no-bucketing",
+        action="store_true",
+        help="Batch utterances in dataset order instead of by duration.",
+    )
     parser.add_argument(
         "--device",
         type=str,
@@ -0,0 +1,256 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "datasets",
+#     "jiwer==3.1.0",
+#     "julius",
+#     "moshi==0.2.11",
+#     "openai-whisper",
+#     "soundfile",
+#     "sphn",
+#     "torch",
+#     "tqdm",
+# ]
+# ///
+"""Transcribe a long file as a batch of overlapping windows.
+
+The sequential path (`stt_from_file_pytorch.py`) runs one model step per 80ms
+of audio, one after the other. Here the audio is cut into `--window` second
+windows overlapping by `--overlap` seconds, each padded with the silence prefix
+and audio delay of the model's `stt_config` like the utterances of
+`stt_evaluate_on_dataset.py`, and the windows are transcribed as rows of one
+batch with its `streaming_transcribe`. Words are timestamped per window and
+shifted to file time; each overlap is split at its middle, the words starting
+before the cut coming from the earlier window and the others from the later
+one, and a word seen from both sides of the cut is kept once.
+
+With `--compare`, the file is also transcribed sequentially and the WER of the
+chunked transcript against it is reported with `AsrMetrics`.
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import julius
+import moshi.models
+import sphn
+import torch
+from stt_evaluate_on_dataset import AsrMetrics, get_padded_batch, streaming_transcribe
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from stt_timestamps import batch_tokens_to_timestamped_text  # noqa: E402
+
+
+def split_windows(n_samples, sample_rate, window_seconds, overlap_seconds):
+    """(start, end) sample ranges of overlapping windows covering the audio."""
+    window = int(window_seconds * sample_rate)
+    hop = window - int(overlap_seconds * sample_rate)
+    if hop <= 0:
+        raise ValueError("--overlap must be shorter than --window")
+    windows = []
+    start = 0
+    while True:
+        windows.append((start, min(start + window, n_samples)))
+        if start + window >= n_samples:
+            return windows
+        start += hop
+
+
+def merge_windows(window_words, cuts):
+    """Merge the words of consecutive windows, already in file time.
+
+    `cuts[k]` is the time between windows `k` and `k + 1` at which the
+    transcript switches from one to the other.
+    """
+    merged = []
+    for k, words in enumerate(window_words):
+        lo = cuts[k - 1] if k > 0 else -math.inf
+        hi = cuts[k] if k < len(cuts) else math.inf
+        for word in words:
+            if not lo <= word.timestamp[0] < hi:
+                continue
+            if (
+                merged
+                and merged[-1].text == word.text
+                and abs(merged[-1].timestamp[0] - word.timestamp[0]) < 1.0
+            ):
+                # The same word, on both sides of the cut.
+                continue
+            merged.append(word)
+    return merged
+
+
+def transcribe(
+    rows,
+    mimi,
+    lm_gen,
+    tokenizer,
+    padding_token_id,
+    audio_silence_prefix_seconds,
+    audio_delay_seconds,
+    batch_size,
+):
+    """Timestamped words of each row of audio, `batch_size` rows at a time."""
+    words = []
+    for index in range(0, len(rows), batch_size):
+        batch = [(row, mimi.sample_rate) for row in rows[index : index + batch_size]]
+        padded_batch, steps = get_padded_batch(
+            batch,
+            before_padding=audio_silence_prefix_seconds,
+            after_padding=audio_delay_seconds + 0.5,
+            audio_encoder=mimi,
+        )
+        text_tokens = streaming_transcribe(
+            padded_batch.to(rows[0].device), mimi=mimi, lm_gen=lm_gen, steps=steps
+        )
+        words.extend(
+            batch_tokens_to_timestamped_text(
+                text_tokens,
+                tokenizer,
+                mimi.frame_rate,
+                end_of_padding_id=0,
+                padding_token_id=padding_token_id,
+                offset_seconds=audio_silence_prefix_seconds + audio_delay_seconds,
+            )
+        )
+    return words
+
+
+def shift(word, seconds):
+    start, end = word.timestamp
+    return type(word)(text=word.text, timestamp=(start + seconds, end + seconds))
+
+
+def main(args):
+    info = moshi.models.loaders.CheckpointInfo.from_hf_repo(
+        args.hf_repo,
+        moshi_weights=args.moshi_weight,
+        mimi_weights=args.mimi_weight,
+        tokenizer=args.tokenizer,
+        config_path=args.config_path,
+    )
+
+    mimi = info.get_mimi(device=args.device)
+    tokenizer = info.get_text_tokenizer()
+    lm = info.get_moshi(
+        device=args.device,
+        dtype=torch.bfloat16,
+    )
+    lm_gen = moshi.models.LMGen(lm, temp=0, temp_text=0.0)
+
+    audio_silence_prefix_seconds = info.stt_config.get(
+        "audio_silence_prefix_seconds", 1.0
+    )
+    audio_delay_seconds = info.stt_config.get("audio_delay_seconds", 5.0)
+    padding_token_id = info.raw_config.get("text_padding_token_id", 3)
+
+    audio, input_sample_rate = sphn.read(args.in_file)
+    audio = torch.from_numpy(audio[0]).to(args.device)
+    audio = julius.resample_frac(audio, input_sample_rate, mimi.sample_rate)
+    duration = audio.shape[-1] / mimi.sample_rate
+
+    windows = split_windows(
+        audio.shape[-1], mimi.sample_rate, args.window, args.overlap
+    )
+    cuts = [
+        (windows[k + 1][0] + windows[k][1]) / 2 / mimi.sample_rate
+        for k in range(len(windows) - 1)
+    ]
+    start_time = time.time()
+    window_words = transcribe(
+        [audio[start:end] for start, end in windows],
+        mimi,
+        lm_gen,
+        tokenizer,
+        padding_token_id,
+        audio_silence_prefix_seconds,
+        audio_delay_seconds,
+        args.batch_size,
+    )
+    words = merge_windows(
+        [
+            [shift(word, start / mimi.sample_rate) for word in row]
+            for (start, _), row in zip(windows, window_words)
+        ],
+        cuts,
+    )
+    chunked_time = time.time() - start_time
+
+    print(" ".join(str(word) for word in words))
+    print(
+        f"\n{len(windows)} windows of {args.window:.0f}s, "
+        f"transcribed in {chunked_time:.2f} seconds, RTF = {duration / chunked_time:.2f}"
+    )
+
+    if args.compare:
+        start_time = time.time()
+        (sequential,) = transcribe(
+            [audio],
+            mimi,
+            lm_gen,
+            tokenizer,
+            padding_token_id,
+            audio_silence_prefix_seconds,
+            audio_delay_seconds,
+            batch_size=1,
+        )
+        sequential_time = time.time() - start_time
+        metrics = AsrMetrics()
+        metrics.update(
+            hyp=" ".join(word.text for word in words),
+            ref=" ".join(word.text for word in sequential),
+        )
+        print(
+            f"sequential: {sequential_time:.2f} seconds, RTF = {duration / sequential_time:.2f}; "
+            f"chunked vs sequential === {metrics}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Transcribe a long file as a batch of overlapping windows."
+    )
+    parser.add_argument("in_file", help="The file to transcribe.")
+
+    parser.add_argument(
+        "--hf-repo", type=str, help="HF repo to load the STT model from. "
+    )
+    parser.add_argument("--tokenizer", type=str, help="Path to a local tokenizer file.")
+    parser.add_argument(
+        "--moshi-weight", type=str, help="Path to a local checkpoint file."
+    )
+    parser.add_argument(
+        "--mimi-weight", type=str, help="Path to a local checkpoint file for Mimi."
+    )
+    parser.add_argument(
+        "--config-path", type=str, help="Path to a local config file.", default=None
+    )
+    parser.add_argument(
+        "--window", type=float, default=60.0, help="Window length in seconds."
+    )
+    parser.add_argument(
+        "--overlap",
+        type=float,
+        default=5.0,
+        help="Overlap between consecutive windows in seconds.",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=32, help="Windows transcribed at once."
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Also transcribe sequentially and report the WER between the two.",
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda",
+        help="Device on which to run, defaults to 'cuda'.",
+    )
+    args = parser.parse_args()
+
+    main(args)
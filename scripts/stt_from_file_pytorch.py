@@ -13,9 +13,10 @@ Kyutai STT models.
 """
 
 import argparse
-import dataclasses
 import itertools
 import math
+import os
+import sys
 
 import julius
 import moshi.models
@@ -23,108 +24,18 @@ import sphn
 import time
 import torch
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from stt_aligner import StreamingAligner  # noqa: E402
 
-@dataclasses.dataclass
-class TimestampedText:
-    text: str
-    timestamp: tuple[float, float]
-
-    def __str__(self):
-        return f"{self.text} ({self.timestamp[0]:.2f}:{self.timestamp[1]:.2f})"
-
-
-def tokens_to_timestamped_text(
-    text_tokens,
-    tokenizer,
-    frame_rate,
-    end_of_padding_id,
-    padding_token_id,
-    offset_seconds,
-) -> list[TimestampedText]:
-    text_tokens = text_tokens.cpu().view(-1)
-
-    # Normally `end_of_padding` tokens indicate word boundaries.
-    # Everything between them should be a single word;
-    # the time offset of the those tokens correspond to word start and
-    # end timestamps (minus silence prefix and audio delay).
-    #
-    # However, in rare cases some complexities could arise. Firstly,
-    # for words that are said quickly but are represented with
-    # multiple tokens, the boundary might be omitted. Secondly,
-    # for the very last word the end boundary might not happen.
-    # Below is a code snippet that handles those situations a bit
-    # more carefully.
-
-    sequence_timestamps = []
-
-    def _tstmp(start_position, end_position):
-        return (
-            max(0, start_position / frame_rate - offset_seconds),
-            max(0, end_position / frame_rate - offset_seconds),
-        )
-
-    def _decode(t):
-        t = t[t > padding_token_id]
-        return tokenizer.decode(t.numpy().tolist())
-
-    def _decode_segment(start, end):
-        nonlocal text_tokens
-        nonlocal sequence_timestamps
-
-        text = _decode(text_tokens[start:end])
-        words_inside_segment = text.split()
-
-        if len(words_inside_segment) == 0:
-            return
-        if len(words_inside_segment) == 1:
-            # Single word within the boundaries, the general case
-            sequence_timestamps.append(
-                TimestampedText(text=text, timestamp=_tstmp(start, end))
-            )
-        else:
-            # We're in a rare situation where multiple words are so close they are not separated by `end_of_padding`.
-            # We tokenize words one-by-one; each word is assigned with as many frames as much tokens it has.
-            for adjacent_word in words_inside_segment[:-1]:
-                n_tokens = len(tokenizer.encode(adjacent_word))
-                sequence_timestamps.append(
-                    TimestampedText(
-                        text=adjacent_word, timestamp=_tstmp(start, start + n_tokens)
-                    )
-                )
-                start += n_tokens
 
-            # The last word takes everything until the boundary
-            adjacent_word = words_inside_segment[-1]
-            sequence_timestamps.append(
-                TimestampedText(text=adjacent_word, timestamp=_tstmp(start, end))
-            )
-
-    (segment_boundaries,) = torch.where(text_tokens == end_of_padding_id)
-
-    if not segment_boundaries.numel():
-        return []
-
-    for i in range(len(segment_boundaries) - 1):
-        segment_start = int(segment_boundaries[i]) + 1
-        segment_end = int(segment_boundaries[i + 1])
-
-        _decode_segment(segment_start, segment_end)
-
-    last_segment_start = segment_boundaries[-1] + 1
-
-    boundary_token = torch.tensor([tokenizer.eos_id()])
-    (end_of_last_segment,) = torch.where(
-        torch.isin(text_tokens[last_segment_start:], boundary_token)
-    )
-
-    if not end_of_last_segment.numel():
-        # upper-bound either end of the audio or 1 second duration, whicher is smaller
-        last_segment_end = min(text_tokens.shape[-1], last_segment_start + frame_rate)
-    else:
-        last_segment_end = last_segment_start + end_of_last_segment[0]
-    _decode_segment(last_segment_start, last_segment_end)
-
-    return sequence_timestamps
+def silence_skip_mask(silent, keep):
+    """Frames to skip: all but the first `keep` frames of every run of silent frames."""
+    skip = []
+    run = 0
+    for is_silent in silent:
+        run = run + 1 if is_silent else 0
+        skip.append(run > keep)
+    return skip
 
 
 def main(args):
@@ -160,25 +71,49 @@ def main(args):
         to_pad = mimi.frame_size - audio.shape[-1] % mimi.frame_size
         audio = torch.nn.functional.pad(audio, (0, to_pad))
 
-    text_tokens_accum = []
-
     n_prefix_chunks = math.ceil(audio_silence_prefix_seconds * mimi.frame_rate)
     n_suffix_chunks = math.ceil(audio_delay_seconds * mimi.frame_rate)
     silence_chunk = torch.zeros(
         (1, 1, mimi.frame_size), dtype=torch.float32, device=args.device
     )
 
+    audio_chunks = torch.split(audio[:, None], mimi.frame_size, dim=-1)
+    skip = [False] * len(audio_chunks)
+    if args.skip_silence:
+        # Every silent stretch keeps enough silence for the words before it to
+        # be emitted (the text lags the audio by `audio_delay_seconds`), then
+        # the rest is not fed to the model at all.
+        rms = audio[0].view(-1, mimi.frame_size).pow(2).mean(dim=-1).sqrt()
+        silent = (20 * torch.log10(rms + 1e-10) < args.silence_db).tolist()
+        keep = math.ceil((audio_delay_seconds + args.min_silence) * mimi.frame_rate)
+        skip = silence_skip_mask(silent, keep)
+
     chunks = itertools.chain(
-        itertools.repeat(silence_chunk, n_prefix_chunks),
-        torch.split(audio[:, None], mimi.frame_size, dim=-1),
-        itertools.repeat(silence_chunk, n_suffix_chunks),
+        itertools.repeat((silence_chunk, False), n_prefix_chunks),
+        zip(audio_chunks, skip),
+        itertools.repeat((silence_chunk, False), n_suffix_chunks),
+    )
+
+    # Words are timestamped as soon as the boundary after them is generated.
+    aligner = StreamingAligner(
+        tokenizer,
+        mimi.frame_rate,
+        end_of_padding_id=0,
+        padding_token_id=padding_token_id,
+        offset_seconds=int(n_prefix_chunks / mimi.frame_rate) + audio_delay_seconds,
     )
+    timed_text = []
 
     start_time = time.time()
     nchunks = 0
+    nskipped = 0
     last_print_was_vad = False
     with mimi.streaming(1), lm_gen.streaming(1):
-        for audio_chunk in chunks:
+        for audio_chunk, skipped in chunks:
+            if skipped:
+                nskipped += 1
+                aligner.skip(1)
+                continue
             nchunks += 1
             audio_tokens = mimi.encode(audio_chunk)
             if args.vad:
@@ -191,26 +126,28 @@ def main(args):
             else:
                 text_tokens = lm_gen.step(audio_tokens)
             text_token = text_tokens[0, 0, 0].cpu().item()
-            if text_token not in (0, 3):
-                _text = tokenizer.id_to_piece(text_tokens[0, 0, 0].cpu().item())  # type: ignore
+            words = aligner.push(text_token)
+            timed_text.extend(words)
+            if args.timestamps:
+                for word in words:
+                    print(word, end=" ", flush=True)
+                    last_print_was_vad = False
+            elif text_token not in (0, 3):
+                _text = tokenizer.id_to_piece(text_token)  # type: ignore
                 _text = _text.replace("▁", " ")
                 print(_text, end="", flush=True)
                 last_print_was_vad = False
-            text_tokens_accum.append(text_tokens)
+    timed_text.extend(aligner.flush())
 
-    utterance_tokens = torch.concat(text_tokens_accum, dim=-1)
     dt = time.time() - start_time
     print(
         f"\nprocessed {nchunks} chunks in {dt:.2f} seconds, steps per second: {nchunks / dt:.2f}"
     )
-    timed_text = tokens_to_timestamped_text(
-        utterance_tokens,
-        tokenizer,
-        mimi.frame_rate,
-        end_of_padding_id=0,
-        padding_token_id=padding_token_id,
-        offset_seconds=int(n_prefix_chunks / mimi.frame_rate) + audio_delay_seconds,
-    )
+    if args.skip_silence:
+        print(
+            f"skipped {nskipped} silent chunks, "
+            f"{100 * nskipped / (nchunks + nskipped):.1f}% of the steps"
+        )
 
     decoded = " ".join([str(t) for t in timed_text])
     print(decoded)
@@ -236,6 +173,30 @@ if __name__ == "__main__":
     parser.add_argument(
         "--vad", action="store_true", help="Enable VAD (Voice Activity Detection)."
     )
+    parser.add_argument(
+        "--skip-silence",
+        action="store_true",
+        help="Do not feed long stretches of silence to the model.",
+    )
+    parser.add_argument(
+        "--silence-db",
+        type=float,
+        default=-50.0,
+        help="Chunks with an RMS level below this (dBFS) count as silence.",
+    )
+    parser.add_argument(
+        "--min-silence",
+        type=float,
+        default=0.5,
+        help="Seconds of each silent stretch that are still transcribed, on top "
+        "of the model's audio delay.",
+    )
+    parser.add_argument(
+        "--timestamps",
+        action="store_true",
+        help="Print each word with its timestamps as soon as it is final, "
+        "instead of the raw text pieces.",
+    )
     parser.add_argument(
         "--device",
         type=str,
@@ -12,7 +12,9 @@
 
 import argparse
 import json
+import os
 import queue
+import sys
 
 import mlx.core as mx
 import mlx.nn as nn
@@ -22,6 +24,9 @@ import sounddevice as sd
 from huggingface_hub import hf_hub_download
 from moshi_mlx import models, utils
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from stt_aligner import StreamingAligner  # noqa: E402
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--max-steps", default=4096)
@@ -29,6 +34,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "--vad", action="store_true", help="Enable VAD (Voice Activity Detection)."
     )
+    parser.add_argument(
+        "--timestamps",
+        action="store_true",
+        help="Print each word with its timestamps as soon as it is final, "
+        "instead of the raw text pieces.",
+    )
     args = parser.parse_args()
 
     if args.hf_repo is None:
@@ -44,6 +55,7 @@ if __name__ == "__main__":
     moshi_weights = hf_hub_download(args.hf_repo, moshi_name)
     tokenizer = hf_hub_download(args.hf_repo, lm_config["tokenizer_name"])
 
+    stt_config = lm_config.get("stt_config", {})
     lm_config = models.LmConfig.from_config_dict(lm_config)
     model = models.Lm(lm_config)
     model.set_dtype(mx.bfloat16)
@@ -76,6 +88,16 @@ if __name__ == "__main__":
         check=False,
     )
 
+    # There is no silence prefix here, timestamps only account for the delay
+    # of the text behind the audio.
+    aligner = StreamingAligner(
+        text_tokenizer,
+        12.5,
+        end_of_padding_id=0,
+        padding_token_id=3,
+        offset_seconds=stt_config.get("audio_delay_seconds", 0.5),
+    )
+
     block_queue = queue.Queue()
 
     def audio_callback(indata, _frames, _time, _status):
@@ -109,7 +131,11 @@ if __name__ == "__main__":
             text_token = text_token[0].item()
             audio_tokens = gen.last_audio_tokens()
             _text = None
-            if text_token not in (0, 3):
+            if args.timestamps:
+                for word in aligner.push(text_token):
+                    print(word, end=" ", flush=True)
+                    last_print_was_vad = False
+            elif text_token not in (0, 3):
                 _text = text_tokenizer.id_to_piece(text_token)  # type: ignore
                 _text = _text.replace("▁", " ")
                 print(_text, end="", flush=True)
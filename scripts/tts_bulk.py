@@ -0,0 +1,334 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "moshi==0.2.11",
+#     "numpy",
+#     "prometheus_client",
+#     "sphn",
+#     "torch",
+# ]
+# ///
+"""Offline bulk synthesis of a JSONL manifest.
+
+Each manifest line is an object with an `id`, the `text` to say and optionally a
+`voice` and `params` (`cfg_coef`, `quality` or `n_q`), e.g.
+
+    {"id": "chapter-01-0001", "text": "Hello there.", "params": {"quality": "fast"}}
+
+Items are sorted longest first and dealt round-robin to `--workers` processes,
+each loading the model once on its device (`--devices` is cycled through) and
+running the batching scheduler with `--batch-size` slots. Audio is written to
+`<out-dir>/<id>.wav` and one result line per item (duration, timings, status) is
+appended to the results manifest as soon as it is done, so an interrupted run is
+resumed by running the same command again: items with an `ok` result whose WAV
+is still there are skipped. Run from the repository root so that the service
+modules can be imported.
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
+from collections import deque
+
+import sphn
+import torch
+from moshi.models.loaders import CheckpointInfo
+from moshi.models.tts import DEFAULT_DSM_TTS_REPO, DEFAULT_DSM_TTS_VOICE_REPO, TTSModel
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from quality import MAX_N_Q, quality_n_q  # noqa: E402
+from tts_scheduler import TTSScheduler, decode_frames  # noqa: E402
+from voice_cache import VoiceConditionCache  # noqa: E402
+
+
+def read_manifest(path):
+    items = []
+    seen = set()
+    with open(path) as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item_id = str(item.get("id", ""))
+            if not item_id or os.sep in item_id or item_id.startswith("."):
+                raise ValueError(f"{path}:{lineno}: invalid id {item_id!r}")
+            if item_id in seen:
+                raise ValueError(f"{path}:{lineno}: duplicate id {item_id!r}")
+            if not item.get("text", "").strip():
+                raise ValueError(f"{path}:{lineno}: item {item_id!r} has no text")
+            seen.add(item_id)
+            item["id"] = item_id
+            items.append(item)
+    return items
+
+
+def completed_ids(results_path, out_dir):
+    """Ids of items that already have an `ok` result and their audio on disk."""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run.
+                continue
+            if result.get("status") == "ok" and os.path.exists(
+                os.path.join(out_dir, os.path.basename(result["path"]))
+            ):
+                done.add(result["id"])
+    return done
+
+
+def item_n_q(item):
+    params = item.get("params") or {}
+    if "n_q" in params:
+        return int(params["n_q"])
+    return quality_n_q(params.get("quality"))
+
+
+def shard(items, workers):
+    """Longest first, dealt round-robin so every worker gets a similar load."""
+    items = sorted(items, key=lambda item: len(item["text"]), reverse=True)
+    shards = [items[i::workers] for i in range(workers)]
+    # Within a shard, group by codebook count so the scheduler rarely has to
+    # rebuild its batch for another tier; still longest first within a group.
+    for items in shards:
+        items.sort(key=lambda item: (item_n_q(item), -len(item["text"])))
+    return shards
+
+
+def load_model(device, args):
+    checkpoint_info = CheckpointInfo.from_hf_repo(args.hf_repo)
+    return TTSModel.from_checkpoint_info(
+        checkpoint_info,
+        n_q=MAX_N_Q,
+        temp=args.temp,
+        device=device,
+        voice_repo=args.voice_repo,
+    )
+
+
+def worker(index, device, items, args, results):
+    torch.set_grad_enabled(False)
+    try:
+        tts_model = load_model(device, args)
+        scheduler = TTSScheduler(
+            tts_model,
+            max_batch_size=args.batch_size,
+            compile=args.compile,
+            max_queue=8 * args.batch_size,
+        )
+    except Exception as e:
+        for item in items:
+            results.put(
+                {"id": item["id"], "status": "error", "error": f"worker {index}: {e}"}
+            )
+        results.put(None)
+        return
+
+    voices = VoiceConditionCache()
+    sample_rate = tts_model.mimi.sample_rate
+    # Two jobs per slot in flight, so the next ones are ready to be admitted
+    # while finished ones are decoded and written here.
+    window = 2 * args.batch_size
+    in_flight = deque()
+    pending = iter(items)
+
+    def submit(item):
+        params = item.get("params") or {}
+        voice = item.get("voice") or args.voice
+        if voice.endswith(".safetensors"):
+            voice_path = voice
+        else:
+            voice_path = tts_model.get_voice_path(voice)
+        condition = voices.get(
+            tts_model, voice_path, float(params.get("cfg_coef", args.cfg_coef))
+        )
+        entries = tts_model.prepare_script([item["text"]], padding_between=1)
+        return scheduler.submit(
+            entries,
+            condition.attributes,
+            condition.condition_tensors,
+            n_q=item_n_q(item),
+            priority="batch",
+        )
+
+    def finish(item, job):
+        result = {"id": item["id"], "worker": index, "device": device}
+        try:
+            frames = job.wait()
+            start = time.perf_counter()
+            pcm = decode_frames(tts_model.mimi, frames, args.decode_chunk_frames)
+            decode_seconds = time.perf_counter() - start
+            path = os.path.join(args.out_dir, f"{item['id']}.wav")
+            tmp_path = os.path.join(args.out_dir, f"{item['id']}.tmp.wav")
+            sphn.write_wav(tmp_path, pcm, sample_rate)
+            os.replace(tmp_path, path)
+            duration = len(pcm) / sample_rate
+            generate_seconds = job.finished_at - job.admitted_at
+            result.update(
+                status="ok",
+                path=os.path.basename(path),
+                duration=round(duration, 3),
+                n_q=job.n_q,
+                queue_seconds=round(job.admitted_at - job.submitted_at, 3),
+                generate_seconds=round(generate_seconds, 3),
+                decode_seconds=round(decode_seconds, 3),
+                rtf=round(generate_seconds / duration, 3) if duration else None,
+            )
+        except Exception as e:
+            result.update(status="error", error=str(e))
+        results.put(result)
+
+    try:
+        while True:
+            while len(in_flight) < window:
+                item = next(pending, None)
+                if item is None:
+                    break
+                try:
+                    in_flight.append((item, submit(item)))
+                except Exception as e:
+                    results.put(
+                        {
+                            "id": item["id"],
+                            "worker": index,
+                            "status": "error",
+                            "error": str(e),
+                        }
+                    )
+            if not in_flight:
+                break
+            finish(*in_flight.popleft())
+    finally:
+        scheduler.stop()
+        results.put(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Synthesize a JSONL manifest with sharded multi-process workers"
+    )
+    parser.add_argument("manifest", help="JSONL file of {id, text, voice, params}.")
+    parser.add_argument("out_dir", help="Directory for the WAV files.")
+    parser.add_argument(
+        "--results",
+        help="Results manifest, appended to; defaults to <out-dir>/results.jsonl.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes."
+    )
+    parser.add_argument(
+        "--devices",
+        default="cuda",
+        help="Comma-separated devices, assigned to workers round-robin "
+        "(e.g. 'cuda:0,cuda:1').",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=8, help="Batch slots per worker."
+    )
+    parser.add_argument(
+        "--hf-repo",
+        default=DEFAULT_DSM_TTS_REPO,
+        help="HF repo in which to look for the pretrained models.",
+    )
+    parser.add_argument(
+        "--voice-repo",
+        default=DEFAULT_DSM_TTS_VOICE_REPO,
+        help="HF repo in which to look for pre-computed voice embeddings.",
+    )
+    parser.add_argument(
+        "--voice",
+        default="expresso/ex03-ex01_happy_001_channel1_334s.wav",
+        help="Voice of items that do not set one, relative to the voice repo root.",
+    )
+    parser.add_argument(
+        "--cfg-coef",
+        type=float,
+        default=2.0,
+        help="CFG coefficient of items that do not set one.",
+    )
+    parser.add_argument("--temp", type=float, default=0.6, help="Sampling temperature.")
+    parser.add_argument(
+        "--decode-chunk-frames",
+        type=int,
+        default=64,
+        help="Frames per Mimi decode call.",
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="torch.compile the per-step depformer call.",
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    results_path = args.results or os.path.join(args.out_dir, "results.jsonl")
+    items = read_manifest(args.manifest)
+    done = completed_ids(results_path, args.out_dir)
+    todo = [item for item in items if item["id"] not in done]
+    print(f"{len(items)} items, {len(done)} already done, {len(todo)} to synthesize")
+    if not todo:
+        return
+
+    devices = args.devices.split(",")
+    workers = max(1, min(args.workers, len(todo)))
+    context = mp.get_context("spawn")
+    results = context.Queue()
+    processes = []
+    for index, items in enumerate(shard(todo, workers)):
+        device = devices[index % len(devices)]
+        process = context.Process(
+            target=worker, args=(index, device, items, args, results)
+        )
+        process.start()
+        processes.append(process)
+
+    start = time.perf_counter()
+    running = len(processes)
+    ok = failed = 0
+    audio_seconds = 0.0
+    with open(results_path, "a") as f:
+        while running:
+            try:
+                result = results.get(timeout=1.0)
+            except queue.Empty:
+                # A worker that died without its end marker (e.g. killed by
+                # the OOM killer) will not send anything else.
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            if result is None:
+                running -= 1
+                continue
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+            if result["status"] == "ok":
+                ok += 1
+                audio_seconds += result["duration"]
+            else:
+                failed += 1
+                print(f"{result['id']}: {result['error']}")
+            if (ok + failed) % 100 == 0:
+                print(f"{ok + failed}/{len(todo)} done")
+    for process in processes:
+        process.join()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{ok} ok, {failed} failed, {len(todo) - ok - failed} missing; "
+        f"{audio_seconds:.1f}s of audio in {elapsed:.1f}s "
+        f"({audio_seconds / elapsed:.2f}x real time)"
+    )
+    if ok + failed < len(todo):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
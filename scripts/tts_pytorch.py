@@ -19,6 +19,26 @@ from moshi.models.loaders import CheckpointInfo
 from moshi.models.tts import DEFAULT_DSM_TTS_REPO, DEFAULT_DSM_TTS_VOICE_REPO, TTSModel
 
 
+def decode_frames(mimi, frames, chunk_frames: int) -> np.ndarray:
+    """Decodes a fully generated utterance with `chunk_frames` frames per Mimi call,
+    keeping everything on device until a single clip and host copy at the end."""
+    codes = torch.cat(frames, dim=-1)[:, 1:, :]
+    pcms = []
+    with mimi.streaming(1), torch.no_grad():
+        for start in range(0, codes.shape[-1], chunk_frames):
+            pcms.append(mimi.decode(codes[..., start : start + chunk_frames]))
+    return torch.cat(pcms, dim=-1).clamp(-1, 1)[0, 0].cpu().numpy()
+
+
+def decode_frames_streaming(mimi, frames) -> np.ndarray:
+    with mimi.streaming(1), torch.no_grad():
+        pcms = []
+        for frame in frames:
+            pcm = mimi.decode(frame[:, 1:, :]).cpu().numpy()
+            pcms.append(np.clip(pcm[0, 0], -1, 1))
+        return np.concatenate(pcms, axis=-1)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Run Kyutai TTS using the PyTorch implementation"
@@ -50,6 +70,17 @@ def main():
         default="cuda",
         help="Device on which to run, defaults to 'cuda'.",
     )
+    parser.add_argument(
+        "--decode-chunk-frames",
+        type=int,
+        default=64,
+        help="Frames per Mimi decode call when writing to a file, 1 decodes frame by frame.",
+    )
+    parser.add_argument(
+        "--check-decode",
+        action="store_true",
+        help="Also decode frame by frame and report the max sample difference.",
+    )
     args = parser.parse_args()
 
     print("Loading model...")
@@ -129,12 +160,18 @@ def main():
             [entries], [condition_attributes], on_frame=_on_frame
         )
         print(f"\nTotal time: {time.time() - start_time:.2f}s")
-        with tts_model.mimi.streaming(1), torch.no_grad():
-            pcms = []
-            for frame in result.frames[tts_model.delay_steps :]:
-                pcm = tts_model.mimi.decode(frame[:, 1:, :]).cpu().numpy()
-                pcms.append(np.clip(pcm[0, 0], -1, 1))
-            pcm = np.concatenate(pcms, axis=-1)
+        frames = result.frames[tts_model.delay_steps :]
+        start_time = time.time()
+        if args.decode_chunk_frames > 1:
+            pcm = decode_frames(tts_model.mimi, frames, args.decode_chunk_frames)
+        else:
+            pcm = decode_frames_streaming(tts_model.mimi, frames)
+        print(f"Decode time: {time.time() - start_time:.2f}s")
+        if args.check_decode:
+            reference = decode_frames_streaming(tts_model.mimi, frames)
+            print(
+                f"Max abs diff vs frame-by-frame: {np.abs(pcm - reference).max():.2e}"
+            )
         sphn.write_wav(args.out, pcm, tts_model.mimi.sample_rate)
 
 
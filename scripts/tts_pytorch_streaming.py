@@ -2,6 +2,7 @@
 # requires-python = ">=3.12"
 # dependencies = [
 #     "moshi==0.2.11",
+#     "numpy",
 #     "torch",
 #     "sphn",
 #     "sounddevice",
@@ -9,6 +10,7 @@
 # ///
 import argparse
 from dataclasses import dataclass
+import os
 import sys
 
 import numpy as np
@@ -29,6 +31,9 @@ from moshi.models.tts import (
     script_to_entries,
 )
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from tts_step import compile_lm_gen, needs_sampled_token  # noqa: E402
+
 
 def prepare_script(model: TTSModel, script: str, first_turn: bool) -> list[Entry]:
     multi_speaker = first_turn and model.multi_speaker
@@ -54,6 +59,7 @@ class TTSGen:
     tts_model: TTSModel
     attributes: tp.Sequence[ConditionAttributes]
     on_frame: tp.Optional[tp.Callable[[torch.Tensor], None]] = None
+    compile: bool = False
 
     def __post_init__(self):
         tts_model = self.tts_model
@@ -80,23 +86,26 @@ class TTSGen:
                 )
             return text_logits
 
+        # audio_masks[offset] marks the codebooks still inside their delay at
+        # that offset; past the last one nothing is masked.
+        audio_delays = tts_model.lm.delays[tts_model.lm.audio_offset :]
+        offsets = torch.arange(max(audio_delays) + tts_model.delay_steps)
+        thresholds = torch.tensor(audio_delays) + tts_model.delay_steps
+        audio_masks = (offsets[:, None] < thresholds[None, :]).to(tts_model.lm.device)
+
         def _on_audio_hook(audio_tokens):
-            audio_offset = tts_model.lm.audio_offset
-            delays = tts_model.lm.delays
-            for q in range(audio_tokens.shape[1]):
-                delay = delays[q + audio_offset]
-                if self.offset < delay + tts_model.delay_steps:
-                    audio_tokens[:, q] = tts_model.machine.token_ids.zero
+            if self.offset < len(audio_masks):
+                mask = audio_masks[self.offset, : audio_tokens.shape[1]]
+                audio_tokens.masked_fill_(mask, tts_model.machine.token_ids.zero)
 
         def _on_text_hook(text_tokens):
-            tokens = text_tokens.tolist()
-            out_tokens = []
-            for token in tokens:
-                out_token, _ = tts_model.machine.process(self.offset, self.state, token)
-                out_tokens.append(out_token)
-            text_tokens[:] = torch.tensor(
-                out_tokens, dtype=torch.long, device=text_tokens.device
-            )
+            # All rows share `self.state`; the sampled tokens are only copied to
+            # the host on steps where the transition depends on them.
+            token = tts_model.machine.token_ids.pad
+            if needs_sampled_token(self.state):
+                token = text_tokens[0].item()
+            out_token, _ = tts_model.machine.process(self.offset, self.state, token)
+            text_tokens.fill_(out_token)
 
         tts_model.lm.dep_q = tts_model.n_q
         self.lm_gen = LMGen(
@@ -112,6 +121,15 @@ class TTSGen:
             cfg_is_no_text=True,
         )
         self.lm_gen.streaming_forever(1)
+        if self.compile:
+            compile_lm_gen(self.lm_gen)
+        # Only read by `lm_gen.step`, so a single buffer serves every step.
+        self.input_tokens = torch.full(
+            (1, tts_model.lm.n_q - tts_model.lm.dep_q, 1),
+            tts_model.machine.token_ids.zero,
+            dtype=torch.long,
+            device=tts_model.lm.device,
+        )
 
     def process_last(self):
         while len(self.state.entries) > 0 or self.state.end_step is not None:
@@ -127,14 +145,7 @@ class TTSGen:
             self._step()
 
     def _step(self):
-        missing = self.tts_model.lm.n_q - self.tts_model.lm.dep_q
-        input_tokens = torch.full(
-            (1, missing, 1),
-            self.tts_model.machine.token_ids.zero,
-            dtype=torch.long,
-            device=self.tts_model.lm.device,
-        )
-        frame = self.lm_gen.step(input_tokens)
+        frame = self.lm_gen.step(self.input_tokens)
         self.offset += 1
         if frame is not None:
             if self.on_frame is not None:
@@ -175,6 +186,11 @@ def main():
         default="cuda",
         help="Device on which to run, defaults to 'cuda'.",
     )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="torch.compile the per-step depformer call.",
+    )
     args = parser.parse_args()
 
     print("Loading model...")
@@ -215,7 +231,12 @@ def main():
             except queue.Empty:
                 outdata[:] = 0
 
-        gen = TTSGen(tts_model, [condition_attributes], on_frame=_on_frame)
+        gen = TTSGen(
+            tts_model,
+            [condition_attributes],
+            on_frame=_on_frame,
+            compile=args.compile,
+        )
 
         with sd.OutputStream(
             samplerate=tts_model.mimi.sample_rate,
@@ -243,7 +264,12 @@ def main():
                 pcm = tts_model.mimi.decode(frame[:, 1:, :]).cpu().numpy()
                 pcms.append(np.clip(pcm[0, 0]))
 
-        gen = TTSGen(tts_model, [condition_attributes], on_frame=_on_frame)
+        gen = TTSGen(
+            tts_model,
+            [condition_attributes],
+            on_frame=_on_frame,
+            compile=args.compile,
+        )
         with tts_model.mimi.streaming(1):
             first_turn = True
             for line in sys.stdin:
@@ -0,0 +1,141 @@
+"""Word timestamps from the text tokens of the streaming STT models.
+
+Normally `end_of_padding` tokens indicate word boundaries. Everything between
+two of them should be a single word; the time offsets of those tokens are the
+word start and end timestamps (minus silence prefix and audio delay).
+
+However, in rare cases some complexities could arise. Firstly, for words that
+are said quickly but are represented with multiple tokens, the boundary might
+be omitted. Secondly, for the very last word the end boundary might not
+happen. Both are handled below.
+"""
+
+import dataclasses
+import math
+
+
+@dataclasses.dataclass
+class TimestampedText:
+    text: str
+    timestamp: tuple[float, float]
+
+    def __str__(self):
+        return f"{self.text} ({self.timestamp[0]:.2f}:{self.timestamp[1]:.2f})"
+
+
+def _timestamp(start, end, frame_rate, offset_seconds):
+    return (
+        max(0, start / frame_rate - offset_seconds),
+        max(0, end / frame_rate - offset_seconds),
+    )
+
+
+def segment_words(
+    text, start, end, tokenizer, frame_rate, offset_seconds, n_tokens=None
+):
+    """Words of the segment of frames `[start, end)` whose tokens decode to `text`.
+
+    A single word gets the whole segment. Otherwise the words were said so close
+    together that they are not separated by `end_of_padding`: each word is
+    assigned as many frames as it has tokens, and the last one takes everything
+    until the boundary. `n_tokens` are the token counts of the words, computed
+    with `tokenizer.encode` when not given.
+    """
+    words = text.split()
+    if len(words) == 0:
+        return []
+    if len(words) == 1:
+        return [
+            TimestampedText(
+                text=text, timestamp=_timestamp(start, end, frame_rate, offset_seconds)
+            )
+        ]
+    if n_tokens is None:
+        n_tokens = [len(tokenizer.encode(word)) for word in words[:-1]]
+    timestamped = []
+    for word, count in zip(words[:-1], n_tokens):
+        timestamped.append(
+            TimestampedText(
+                text=word,
+                timestamp=_timestamp(start, start + count, frame_rate, offset_seconds),
+            )
+        )
+        start += count
+    timestamped.append(
+        TimestampedText(
+            text=words[-1], timestamp=_timestamp(start, end, frame_rate, offset_seconds)
+        )
+    )
+    return timestamped
+
+
+class StreamingAligner:
+    """Online counterpart of `stt_timestamps.tokens_to_timestamped_text`.
+
+    Consumes the text token of each step with `push`, which returns the words
+    finalized by that token: a segment is complete as soon as the next
+    `end_of_padding` token is seen. `flush` finalizes the last segment at the end
+    of the stream, ending it at the first EOS or else after one second. Only the
+    text tokens of the open segment are kept, and the words are the same as
+    those of `tokens_to_timestamped_text` over the whole sequence.
+
+    `tokenizer` only needs `decode`, `encode` and `eos_id`, so the MLX scripts
+    can use it with token ids from `mlx` arrays.
+    """
+
+    def __init__(
+        self, tokenizer, frame_rate, end_of_padding_id, padding_token_id, offset_seconds
+    ):
+        self.tokenizer = tokenizer
+        self.frame_rate = frame_rate
+        self.end_of_padding_id = end_of_padding_id
+        self.padding_token_id = padding_token_id
+        self.offset_seconds = offset_seconds
+        self.eos_id = tokenizer.eos_id()
+        self.position = 0
+        # First frame of the open segment, None before the first boundary.
+        self.start = None
+        # (position, token) of the text tokens of the open segment.
+        self.tokens = []
+        self.eos = None
+
+    def push(self, token) -> list[TimestampedText]:
+        position = self.position
+        self.position += 1
+        if token == self.end_of_padding_id:
+            words = self._segment(position) if self.start is not None else []
+            self.start = position + 1
+            self.tokens = []
+            self.eos = None
+            return words
+        if self.start is not None:
+            if token > self.padding_token_id:
+                self.tokens.append((position, token))
+            elif token == self.eos_id and self.eos is None:
+                self.eos = position
+        return []
+
+    def skip(self, frames):
+        """Let `frames` steps pass without a token, for audio that was not fed to
+        the model, so that later words keep their position in the audio."""
+        self.position += frames
+
+    def flush(self) -> list[TimestampedText]:
+        if self.start is None:
+            return []
+        if self.eos is not None:
+            end = self.eos
+        else:
+            end = min(self.position, self.start + math.floor(self.frame_rate))
+        words = self._segment(end)
+        self.start = None
+        self.tokens = []
+        self.eos = None
+        return words
+
+    def _segment(self, end):
+        tokens = [token for position, token in self.tokens if position < end]
+        text = self.tokenizer.decode(tokens)
+        return segment_words(
+            text, self.start, end, self.tokenizer, self.frame_rate, self.offset_seconds
+        )
@@ -0,0 +1,275 @@
+import threading
+from dataclasses import dataclass, field
+
+import numpy as np
+import torch
+from moshi.models.lm import LMGen
+
+
+class NoFreeSlot(RuntimeError):
+    pass
+
+
+@dataclass
+class _Word:
+    tokens: list = field(default_factory=list)
+    # Step of the `end_of_padding` token that opened the word.
+    boundary: int | None = None
+    # Decoded text once padding followed the tokens, '' if it was empty.
+    text: str | None = None
+
+
+@dataclass
+class ASRStream:
+    """One client stream attached to a slot of `BatchedASR`.
+
+    `listener` is called from the step thread with each outgoing message (a
+    dict in the msgpack schema of the Rust `BatchedAsr` module) and with None
+    once the stream has been detached.
+    """
+
+    listener: object
+    slot: int | None = None
+    pcm: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.float32))
+    # Model steps run for this stream, i.e. 80ms chunks consumed.
+    steps: int = 0
+    word: _Word = field(default_factory=_Word)
+    # (step at which to echo the marker, marker id)
+    markers: list = field(default_factory=list)
+    closed: bool = False
+
+
+class BatchedASR:
+    """Fixed-slot batched streaming STT, the Python counterpart of the Rust
+    server's `BatchedAsr` module.
+
+    Mimi and the LM stream with `batch_size` rows for the lifetime of the
+    object. A client stream attaches to a free row, whose streaming state is
+    reset, and feeds PCM at its own pace; every step runs one 1920-sample chunk
+    for each row that has one buffered, and the exec mask keeps the other rows
+    (idle or free) exactly where they were. Detaching just frees the row.
+    """
+
+    def __init__(
+        self,
+        mimi,
+        lm,
+        tokenizer,
+        batch_size=64,
+        audio_delay_seconds=0.5,
+        padding_token_id=3,
+        end_of_padding_id=0,
+        max_buffer_seconds=30.0,
+    ):
+        self.mimi = mimi
+        # Rows start at different times, so outputs are masked per row instead
+        # of withheld for the whole batch during the first steps.
+        self.lm_gen = LMGen(lm, temp=0, temp_text=0.0, support_out_of_sync=True)
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.audio_delay_seconds = audio_delay_seconds
+        self.padding_token_id = padding_token_id
+        self.end_of_padding_id = end_of_padding_id
+        self.max_buffer_samples = int(max_buffer_seconds * mimi.sample_rate)
+        self.frame_size = mimi.frame_size
+        self.frame_rate = mimi.frame_rate
+        self.device = next(mimi.parameters()).device
+        self.delay_steps = round(audio_delay_seconds * self.frame_rate)
+        self.has_extra_heads = len(lm.extra_heads) > 0
+
+        self.slots = [None] * batch_size
+        self.joining = []
+        self._rows = None
+        self.lock = threading.Lock()
+        self.steps = 0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._ready = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="stt-batch", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    @property
+    def active(self):
+        return sum(stream is not None for stream in self.slots)
+
+    def attach(self, listener):
+        """Claim a free slot for a new stream; raises `NoFreeSlot` when all are taken."""
+        with self.lock:
+            taken = {stream.slot for stream in self.joining}
+            for slot, stream in enumerate(self.slots):
+                if stream is None and slot not in taken:
+                    break
+            else:
+                raise NoFreeSlot(f"All {self.batch_size} STT slots are in use")
+            stream = ASRStream(listener, slot=slot)
+            self.joining.append(stream)
+        self._wakeup.set()
+        return stream
+
+    def feed(self, stream, pcm):
+        pcm = np.asarray(pcm, dtype=np.float32)
+        with self.lock:
+            if len(stream.pcm) + len(pcm) > self.max_buffer_samples:
+                raise RuntimeError(
+                    "Audio is arriving faster than it can be transcribed"
+                )
+            stream.pcm = np.concatenate([stream.pcm, pcm])
+        self._wakeup.set()
+
+    def marker(self, stream, marker_id):
+        """Echo `marker_id` back once the audio fed so far has been transcribed."""
+        with self.lock:
+            due = stream.steps + len(stream.pcm) // self.frame_size + self.delay_steps
+            stream.markers.append((due, marker_id))
+
+    def detach(self, stream):
+        stream.closed = True
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            with (
+                torch.no_grad(),
+                self.mimi.streaming(self.batch_size),
+                self.lm_gen.streaming(self.batch_size),
+            ):
+                self._ready.set()
+                while not self._stopped.is_set():
+                    self._update_slots()
+                    if not self._step():
+                        self._wakeup.wait(0.05)
+                        self._wakeup.clear()
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            for stream in self.slots:
+                if stream is not None:
+                    stream.listener({"type": "Error", "message": str(e)})
+                    stream.listener(None)
+            raise
+
+    def _update_slots(self):
+        with self.lock:
+            joining, self.joining = self.joining, []
+        for slot, stream in enumerate(self.slots):
+            if stream is not None and stream.closed:
+                self.slots[slot] = None
+                stream.listener(None)
+        if joining:
+            reset_mask = torch.zeros(self.batch_size, dtype=torch.bool)
+            for stream in joining:
+                self.slots[stream.slot] = stream
+                reset_mask[stream.slot] = True
+            reset_mask = reset_mask.to(self.device)
+            self.mimi.reset_streaming(reset_mask)
+            self.lm_gen.reset_streaming(reset_mask)
+            # Resetting also re-enables execution of the reset rows.
+            self._rows = None
+
+    def _step(self):
+        rows = []
+        chunk = np.zeros((self.batch_size, 1, self.frame_size), dtype=np.float32)
+        with self.lock:
+            for slot, stream in enumerate(self.slots):
+                if (
+                    stream is not None
+                    and not stream.closed
+                    and len(stream.pcm) >= self.frame_size
+                ):
+                    chunk[slot, 0] = stream.pcm[: self.frame_size]
+                    stream.pcm = stream.pcm[self.frame_size :]
+                    rows.append(slot)
+        if not rows:
+            return False
+
+        if rows != self._rows:
+            exec_mask = torch.zeros(self.batch_size, dtype=torch.bool)
+            exec_mask[rows] = True
+            exec_mask = exec_mask.to(self.device)
+            self.mimi.set_exec_mask(exec_mask)
+            self.lm_gen.set_exec_mask(exec_mask)
+            self._rows = rows
+        audio_tokens = self.mimi.encode(torch.from_numpy(chunk).to(self.device))
+        if self.has_extra_heads:
+            text_tokens, extra_heads = self.lm_gen.step_with_extra_heads(audio_tokens)
+            prs = (
+                torch.stack([head[:, 0, 0] for head in extra_heads], dim=1)
+                .float()
+                .cpu()
+                .numpy()
+            )
+        else:
+            text_tokens = self.lm_gen.step(audio_tokens)
+            prs = None
+        # One device-to-host copy for the whole batch.
+        text_tokens = text_tokens[:, 0, 0].cpu().numpy()
+        self.steps += 1
+
+        for slot in rows:
+            stream = self.slots[slot]
+            for message in self._process_token(stream, int(text_tokens[slot])):
+                stream.listener(message)
+            stream.listener(
+                {
+                    "type": "Step",
+                    "step_idx": stream.steps,
+                    "prs": [] if prs is None else prs[slot].tolist(),
+                    "buffered_pcm": len(stream.pcm),
+                }
+            )
+            stream.steps += 1
+            while stream.markers and stream.markers[0][0] <= stream.steps:
+                stream.listener({"type": "Marker", "id": stream.markers.pop(0)[1]})
+        return True
+
+    def _time(self, step):
+        return max(0.0, step / self.frame_rate - self.audio_delay_seconds)
+
+    def _process_token(self, stream, token):
+        """Word/EndWord messages for the token a stream produced at `stream.steps`.
+
+        An `end_of_padding` token opens a word, whose text is sent as soon as
+        padding follows its tokens; the next `end_of_padding` closes it.
+        """
+        step = stream.steps
+        word = stream.word
+        messages = []
+        if token == self.end_of_padding_id:
+            messages.extend(self._send_word(word))
+            if word.text:
+                messages.append({"type": "EndWord", "stop_time": self._time(step)})
+            stream.word = _Word(boundary=step)
+        elif token > self.padding_token_id:
+            if word.text is not None:
+                # More text before the next boundary: words said too quickly to
+                # be separated. Close the previous one and start a new word here.
+                if word.text:
+                    messages.append({"type": "EndWord", "stop_time": self._time(step)})
+                stream.word = word = _Word(boundary=step - 1)
+            word.tokens.append(token)
+        elif token == self.padding_token_id:
+            messages.extend(self._send_word(word))
+        return messages
+
+    def _send_word(self, word):
+        if word.text is not None or not word.tokens or word.boundary is None:
+            return []
+        word.text = self.tokenizer.decode(word.tokens).strip()
+        if not word.text:
+            return []
+        return [
+            {
+                "type": "Word",
+                "text": word.text,
+                "start_time": self._time(word.boundary + 1),
+            }
+        ]
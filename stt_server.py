@@ -0,0 +1,122 @@
+"""Batched streaming STT server: `python stt_server.py`.
+
+Serves `/api/asr-streaming` with the msgpack protocol of the Rust server's
+`BatchedAsr` module, so `scripts/stt_from_file_rust_server.py` and
+`scripts/stt_from_mic_rust_server.py` work against it unchanged: the client
+sends `{"type": "Audio", "pcm": [...]}` and `{"type": "Marker", "id": ...}`
+messages and receives `Word`, `EndWord`, `Step` and `Marker` messages. Every
+client stream takes one of `STT_BATCH_SIZE` rows of a single model running on
+one GPU process.
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+import msgpack
+import torch
+import uvicorn
+from moshi.models.loaders import CheckpointInfo
+from starlette.applications import Starlette
+from starlette.routing import WebSocketRoute
+
+from stt_batch import BatchedASR, NoFreeSlot
+
+STT_PORT = int(os.getenv("STT_PORT", 8080))
+STT_DEVICE = os.getenv("STT_DEVICE", "cuda")
+STT_HF_REPO = os.getenv("STT_HF_REPO", "kyutai/stt-1b-en_fr")
+STT_BATCH_SIZE = int(os.getenv("STT_BATCH_SIZE", 64))
+# Seconds of audio a client may send ahead of transcription.
+STT_MAX_BUFFER_SECONDS = float(os.getenv("STT_MAX_BUFFER_SECONDS", 30))
+# Comma-separated keys accepted in the `kyutai-api-key` header or `auth_id`
+# query parameter; empty disables authentication.
+STT_API_KEYS = {
+    key for key in os.getenv("STT_API_KEYS", "public_token").split(",") if key
+}
+
+asr = None
+
+
+def load_asr():
+    info = CheckpointInfo.from_hf_repo(STT_HF_REPO)
+    mimi = info.get_mimi(device=STT_DEVICE)
+    tokenizer = info.get_text_tokenizer()
+    lm = info.get_moshi(device=STT_DEVICE, dtype=torch.bfloat16)
+    return BatchedASR(
+        mimi,
+        lm,
+        tokenizer,
+        batch_size=STT_BATCH_SIZE,
+        audio_delay_seconds=info.stt_config.get("audio_delay_seconds", 5.0),
+        padding_token_id=info.raw_config.get("text_padding_token_id", 3),
+        max_buffer_seconds=STT_MAX_BUFFER_SECONDS,
+    )
+
+
+async def asr_streaming(websocket):
+    api_key = websocket.headers.get("kyutai-api-key") or websocket.query_params.get(
+        "auth_id"
+    )
+    if STT_API_KEYS and api_key not in STT_API_KEYS:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    loop = asyncio.get_running_loop()
+    messages = asyncio.Queue()
+
+    def listener(message):
+        loop.call_soon_threadsafe(messages.put_nowait, message)
+
+    try:
+        stream = asr.attach(listener)
+    except NoFreeSlot as e:
+        await websocket.send_bytes(msgpack.packb({"type": "Error", "message": str(e)}))
+        await websocket.close()
+        return
+
+    async def receive_audio():
+        try:
+            async for message in websocket.iter_bytes():
+                msg = msgpack.unpackb(message)
+                if msg["type"] == "Audio":
+                    asr.feed(stream, msg["pcm"])
+                elif msg["type"] == "Marker":
+                    asr.marker(stream, msg["id"])
+        except Exception as e:
+            listener({"type": "Error", "message": str(e)})
+        finally:
+            asr.detach(stream)
+
+    async def send_messages():
+        while (message := await messages.get()) is not None:
+            await websocket.send_bytes(msgpack.packb(message, use_single_float=True))
+            if message["type"] == "Error":
+                break
+
+    receiver = asyncio.create_task(receive_audio())
+    try:
+        await send_messages()
+        await websocket.close()
+    except Exception:
+        pass
+    finally:
+        receiver.cancel()
+        asr.detach(stream)
+
+
+@asynccontextmanager
+async def lifespan(_):
+    global asr
+    asr = await asyncio.get_running_loop().run_in_executor(None, load_asr)
+    yield
+    asr.stop()
+
+
+app = Starlette(
+    routes=[WebSocketRoute("/api/asr-streaming", asr_streaming)], lifespan=lifespan
+)
+
+if __name__ == "__main__":
+    # One process: the batch lives in it.
+    uvicorn.run(app, host="0.0.0.0", port=STT_PORT, workers=1)
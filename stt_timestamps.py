@@ -0,0 +1,93 @@
+"""Word timestamps of whole token sequences, see `stt_aligner` for the rules
+and for the streaming version."""
+
+import math
+
+import torch
+
+from stt_aligner import TimestampedText, segment_words
+
+
+def batch_tokens_to_timestamped_text(
+    text_tokens,
+    tokenizer,
+    frame_rate,
+    end_of_padding_id,
+    padding_token_id,
+    offset_seconds,
+) -> list[list[TimestampedText]]:
+    """Timestamped words of every row of a `[B, T]` (or `[B, 1, T]`) token matrix.
+
+    Segment spans are computed for all rows at once with tensor ops, and the
+    tokenizer is called once for the whole batch: one `decode` of every segment
+    and one `encode` of the words of the rare segments holding several words.
+    """
+    text_tokens = text_tokens.cpu()
+    text_tokens = text_tokens.reshape(text_tokens.shape[0], -1).contiguous()
+    B, T = text_tokens.shape
+    positions = torch.arange(T)
+
+    rows, boundaries = torch.nonzero(text_tokens == end_of_padding_id, as_tuple=True)
+    if not rows.numel():
+        return [[] for _ in range(B)]
+    starts = boundaries + 1
+    # A segment ends at the next boundary of its row...
+    ends = torch.empty_like(boundaries)
+    ends[:-1] = boundaries[1:]
+    is_last = torch.ones_like(rows, dtype=torch.bool)
+    is_last[:-1] = rows[1:] != rows[:-1]
+    # ...and the last one of a row at the first EOS after it, or else at the end
+    # of the audio or one second later, whichever comes first.
+    eos = torch.where(text_tokens == tokenizer.eos_id(), positions, T + 1)
+    next_eos = eos.flip(-1).cummin(-1).values.flip(-1)
+    next_eos = torch.cat([next_eos, torch.full((B, 1), T + 1)], dim=-1)
+    last_eos = next_eos[rows, starts]
+    fallback = torch.clamp(starts + math.floor(frame_rate), max=T)
+    ends = torch.where(is_last, torch.where(last_eos <= T, last_eos, fallback), ends)
+
+    # The text tokens of a segment are a slice of the flattened text tokens of
+    # the whole matrix, located with a running count.
+    kept = (text_tokens > padding_token_id).view(-1)
+    flat = text_tokens.view(-1)[kept].tolist()
+    counts = torch.cat([torch.zeros(1, dtype=torch.long), kept.cumsum(0)])
+    lo = counts[rows * T + starts].tolist()
+    hi = counts[rows * T + ends].tolist()
+    texts = tokenizer.decode([flat[a:b] for a, b in zip(lo, hi)])
+
+    # Token counts of the words of multi-word segments, in one encode call.
+    words = [text.split() for text in texts]
+    adjacent = [word for split in words if len(split) > 1 for word in split[:-1]]
+    n_adjacent = iter(tokenizer.encode(adjacent) if adjacent else [])
+
+    timestamped = [[] for _ in range(B)]
+    for row, start, end, text, split in zip(
+        rows.tolist(), starts.tolist(), ends.tolist(), texts, words
+    ):
+        n_tokens = (
+            [len(next(n_adjacent)) for _ in split[:-1]] if len(split) > 1 else None
+        )
+        timestamped[row].extend(
+            segment_words(
+                text, start, end, tokenizer, frame_rate, offset_seconds, n_tokens
+            )
+        )
+    return timestamped
+
+
+def tokens_to_timestamped_text(
+    text_tokens,
+    tokenizer,
+    frame_rate,
+    end_of_padding_id,
+    padding_token_id,
+    offset_seconds,
+) -> list[TimestampedText]:
+    """Timestamped words of a single token sequence."""
+    return batch_tokens_to_timestamped_text(
+        text_tokens.reshape(1, -1),
+        tokenizer,
+        frame_rate,
+        end_of_padding_id,
+        padding_token_id,
+        offset_seconds,
+    )[0]
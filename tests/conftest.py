@@ -0,0 +1,182 @@
+"""Tiny randomly initialized TTS models, so the server modules can be tested on CPU."""
+
+import os
+import sys
+
+import pytest
+import torch
+from moshi.conditioners import ConditionFuser, ConditionProvider
+from moshi.conditioners.tensors import TensorConditioner
+from moshi.conditioners.text import LUTConditioner
+from moshi.models.compression import MimiModel
+from moshi.models.lm import LMModel
+from moshi.models.tts import StateMachine, TokenIds, TTSModel
+from moshi.modules import SEANetDecoder, SEANetEncoder, transformer
+from moshi.quantization import SplitResidualVectorQuantizer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+N_Q = 4
+CARD = 64
+TEXT_CARD = 64
+DIM = 32
+VOICE_DIM = 8
+VOICE_FRAMES = 3
+
+
+class CharTokenizer:
+    """Stands in for the SentencePiece tokenizer: one token per character."""
+
+    def encode(self, text):
+        return [4 + ord(c) % (TEXT_CARD - 4) for c in text]
+
+
+def make_mimi(device="cpu"):
+    seanet_kwargs = {
+        "channels": 1,
+        "dimension": 16,
+        "causal": True,
+        "n_filters": 2,
+        "n_residual_layers": 1,
+        "ratios": [8, 6, 5, 4],
+        "norm": "none",
+        "pad_mode": "constant",
+        "true_skip": True,
+    }
+    transformer_kwargs = {
+        "d_model": 16,
+        "num_heads": 2,
+        "num_layers": 1,
+        "causal": True,
+        "layer_scale": 0.01,
+        "context": 50,
+        "conv_layout": True,
+        "max_period": 10000,
+        "gating": "none",
+        "norm": "layer_norm",
+        "positional_embedding": "rope",
+        "dim_feedforward": 32,
+        "input_dimension": 16,
+        "output_dimensions": [16],
+    }
+    encoder = SEANetEncoder(**seanet_kwargs)
+    mimi = MimiModel(
+        encoder,
+        SEANetDecoder(**seanet_kwargs),
+        SplitResidualVectorQuantizer(
+            dimension=8,
+            n_q=N_Q,
+            bins=CARD,
+            input_dimension=16,
+            output_dimension=16,
+        ),
+        channels=1,
+        sample_rate=24000,
+        frame_rate=12.5,
+        encoder_frame_rate=24000 / encoder.hop_length,
+        causal=True,
+        resample_method="conv",
+        encoder_transformer=transformer.ProjectedTransformer(
+            device=device, **transformer_kwargs
+        ),
+        decoder_transformer=transformer.ProjectedTransformer(
+            device=device, **transformer_kwargs
+        ),
+    ).to(device)
+    # Codebooks start out zeroed until trained, which would decode every code
+    # to the same audio.
+    for name, buffer in mimi.quantizer.named_buffers():
+        if name.endswith("embedding_sum"):
+            buffer.normal_()
+    mimi.eval()
+    mimi.set_num_codebooks(N_Q)
+    return mimi
+
+
+def make_lm(device="cpu"):
+    conditioners = {
+        "control": LUTConditioner(
+            n_bins=2,
+            tokenizer="noop",
+            possible_values=["ok"],
+            dim=DIM,
+            output_dim=DIM,
+            device=device,
+        ),
+        "cfg": LUTConditioner(
+            n_bins=4,
+            tokenizer="noop",
+            possible_values=["1.0", "2.0"],
+            dim=DIM,
+            output_dim=DIM,
+            device=device,
+        ),
+        "speaker_wavs": TensorConditioner(dim=VOICE_DIM, output_dim=DIM, device=device),
+    }
+    return LMModel(
+        delays=[0, 0, 2, 2, 2],
+        n_q=N_Q,
+        dep_q=N_Q,
+        card=CARD,
+        text_card=TEXT_CARD,
+        dim=DIM,
+        num_heads=2,
+        num_layers=2,
+        hidden_scale=2,
+        context=100,
+        causal=True,
+        layer_scale=None,
+        gating="silu",
+        norm="rms_norm_f32",
+        positional_embedding="rope",
+        max_period=10000,
+        depformer_dim=16,
+        depformer_num_heads=2,
+        depformer_num_layers=1,
+        depformer_layer_scale=None,
+        depformer_multi_linear=True,
+        depformer_context=N_Q,
+        depformer_max_period=10000,
+        depformer_gating="silu",
+        depformer_pos_emb="none",
+        depformer_weights_per_step=True,
+        existing_text_padding_id=3,
+        cross_attention=True,
+        condition_provider=ConditionProvider(conditioners, device=device),
+        fuser=ConditionFuser({"sum": ["control", "cfg"], "cross": ["speaker_wavs"]}),
+        device=device,
+        dtype=torch.float32,
+    ).eval()
+
+
+def make_tts_model(device="cpu", seed=0, **kwargs):
+    torch.manual_seed(seed)
+    lm = make_lm(device)
+    mimi = make_mimi(device)
+    machine = StateMachine(
+        token_ids=TokenIds(lm.text_card + 1), max_padding=4, initial_padding=1
+    )
+    kwargs.setdefault("max_gen_length", 60)
+    tts_model = TTSModel(
+        lm=lm,
+        mimi=mimi,
+        tokenizer=CharTokenizer(),
+        voice_suffix="",
+        voice_repo="",
+        machine=machine,
+        delay_steps=2,
+        n_q=N_Q,
+        **kwargs,
+    )
+    return tts_model
+
+
+def voice_embedding(seed):
+    """A random `speaker_wavs` tensor laid out as in the voice safetensors files."""
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randn(1, VOICE_DIM, VOICE_FRAMES, generator=generator)
+
+
+@pytest.fixture
+def tts_model():
+    return make_tts_model()
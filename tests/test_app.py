@@ -0,0 +1,23 @@
+import importlib
+
+
+def _fail_build(directory, voice_repo):
+    raise RuntimeError("no network in tests")
+
+
+def test_audio_cache_disk_tier_opened_by_prepare_service(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "audio_cache"
+    monkeypatch.setenv("AUDIO_CACHE_DIR", str(cache_dir))
+    monkeypatch.setenv("VOICE_STORE_DIR", str(tmp_path / "voice_store"))
+    app = importlib.import_module("app")
+    # Importing the service must work outside the container.
+    assert not cache_dir.exists()
+    assert app.audio_cache.stats()["disk_max_bytes"] == 0
+
+    monkeypatch.setattr(app, "build_default", _fail_build)
+    monkeypatch.setattr(app.pool, "replicas", [])
+    app.prepare_service()
+    assert cache_dir.is_dir()
+    assert (
+        app.audio_cache.stats()["disk_max_bytes"] == app.AUDIO_CACHE_DISK_MB * 1024**2
+    )
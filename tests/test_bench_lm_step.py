@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+import bench_lm_step  # noqa: E402
+
+TINY = [
+    "--steps=3",
+    "--warmup=1",
+    "--n-q=2",
+    "--card=16",
+    "--text-card=32",
+    "--dim=16",
+    "--num-heads=2",
+    "--num-layers=1",
+    "--depformer-dim=16",
+    "--depformer-num-layers=1",
+    "--context=10",
+]
+
+
+def test_benchmark_runs_every_mode(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["bench_lm_step.py", *TINY])
+    bench_lm_step.main()
+    out = capsys.readouterr().out
+    for name in ("eager", "static", "compiled"):
+        assert f"{name}:" in out
+    assert "torch.compile failed" not in out
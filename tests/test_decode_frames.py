@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import torch
+from conftest import CARD, N_Q, make_mimi
+
+from tts_scheduler import decode_frames
+
+
+def reference_decode(mimi, frames):
+    """The frame-by-frame loop `decode_frames` replaced."""
+    with mimi.streaming(1), torch.no_grad():
+        pcms = []
+        for frame in frames:
+            pcm = mimi.decode(frame[:, 1:, :]).cpu().numpy()
+            pcms.append(np.clip(pcm[0, 0], -1, 1))
+        return np.concatenate(pcms, axis=-1)
+
+
+@pytest.fixture(scope="module")
+def mimi():
+    torch.manual_seed(0)
+    return make_mimi()
+
+
+# Two full 64-frame chunks and a trailing partial one, exactly one chunk, and a
+# single frame.
+@pytest.mark.parametrize("n_frames", [150, 64, 1])
+def test_chunked_decode_matches_frame_by_frame(mimi, n_frames):
+    generator = torch.Generator().manual_seed(n_frames)
+    # Text token first, then the audio codebooks, as the scheduler returns them.
+    frames = [
+        torch.randint(0, CARD, (1, 1 + N_Q, 1), generator=generator)
+        for _ in range(n_frames)
+    ]
+    expected = reference_decode(mimi, frames)
+    pcm = decode_frames(mimi, frames, chunk_frames=64)
+    assert pcm.dtype == np.float32
+    assert pcm.shape == expected.shape
+    assert np.abs(expected).max() > 0
+    np.testing.assert_allclose(pcm, expected, atol=1e-4, rtol=0)
+
+
+def test_decode_no_frames(mimi):
+    assert decode_frames(mimi, []).shape == (0,)
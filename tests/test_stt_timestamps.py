@@ -0,0 +1,203 @@
+import math
+
+import pytest
+import sentencepiece
+import torch
+
+from stt_aligner import TimestampedText
+from stt_timestamps import (
+    batch_tokens_to_timestamped_text,
+    tokens_to_timestamped_text,
+)
+
+END_OF_PADDING_ID = 0
+PADDING_TOKEN_ID = 3
+FRAME_RATE = 12.5
+OFFSET_SECONDS = 0.5
+
+CORPUS = """\
+the quick brown fox jumps over the lazy dog
+a journey of a thousand miles begins with a single step
+speech recognition turns spoken words into written text
+every word gets a start and an end timestamp
+"""
+
+
+@pytest.fixture(scope="module")
+def tokenizer(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("tokenizer")
+    corpus = directory / "corpus.txt"
+    corpus.write_text(CORPUS * 4)
+    sentencepiece.SentencePieceTrainer.train(
+        input=str(corpus),
+        model_prefix=str(directory / "sp"),
+        vocab_size=80,
+        model_type="bpe",
+        minloglevel=2,
+    )
+    return sentencepiece.SentencePieceProcessor(str(directory / "sp.model"))
+
+
+def reference_tokens_to_timestamped_text(
+    text_tokens,
+    tokenizer,
+    frame_rate,
+    end_of_padding_id,
+    padding_token_id,
+    offset_seconds,
+):
+    """The per-segment loop `batch_tokens_to_timestamped_text` replaced.
+
+    Kept as it was, except that the one-second fallback end is floored to a
+    frame: the loop added the float frame rate, which could not be sliced with.
+    """
+    text_tokens = text_tokens.cpu().view(-1)
+    sequence_timestamps = []
+
+    def _tstmp(start_position, end_position):
+        return (
+            max(0, start_position / frame_rate - offset_seconds),
+            max(0, end_position / frame_rate - offset_seconds),
+        )
+
+    def _decode(t):
+        t = t[t > padding_token_id]
+        return tokenizer.decode(t.numpy().tolist())
+
+    def _decode_segment(start, end):
+        text = _decode(text_tokens[start:end])
+        words_inside_segment = text.split()
+        if len(words_inside_segment) == 0:
+            return
+        if len(words_inside_segment) == 1:
+            sequence_timestamps.append(
+                TimestampedText(text=text, timestamp=_tstmp(start, end))
+            )
+        else:
+            for adjacent_word in words_inside_segment[:-1]:
+                n_tokens = len(tokenizer.encode(adjacent_word))
+                sequence_timestamps.append(
+                    TimestampedText(
+                        text=adjacent_word, timestamp=_tstmp(start, start + n_tokens)
+                    )
+                )
+                start += n_tokens
+            adjacent_word = words_inside_segment[-1]
+            sequence_timestamps.append(
+                TimestampedText(text=adjacent_word, timestamp=_tstmp(start, end))
+            )
+
+    (segment_boundaries,) = torch.where(text_tokens == end_of_padding_id)
+    if not segment_boundaries.numel():
+        return []
+    for i in range(len(segment_boundaries) - 1):
+        segment_start = int(segment_boundaries[i]) + 1
+        segment_end = int(segment_boundaries[i + 1])
+        _decode_segment(segment_start, segment_end)
+
+    last_segment_start = int(segment_boundaries[-1]) + 1
+    boundary_token = torch.tensor([tokenizer.eos_id()])
+    (end_of_last_segment,) = torch.where(
+        torch.isin(text_tokens[last_segment_start:], boundary_token)
+    )
+    if not end_of_last_segment.numel():
+        last_segment_end = min(
+            text_tokens.shape[-1], last_segment_start + math.floor(frame_rate)
+        )
+    else:
+        last_segment_end = last_segment_start + int(end_of_last_segment[0])
+    _decode_segment(last_segment_start, last_segment_end)
+    return sequence_timestamps
+
+
+def random_tokens(generator, tokenizer, batch_size, length, eos_rate):
+    """Token rows shaped like STT output: padding, word boundaries, word pieces
+    and the occasional EOS."""
+    kinds = torch.rand(batch_size, length, generator=generator)
+    pieces = torch.randint(
+        PADDING_TOKEN_ID + 1,
+        tokenizer.vocab_size(),
+        (batch_size, length),
+        generator=generator,
+    )
+    tokens = torch.full((batch_size, length), PADDING_TOKEN_ID)
+    tokens = torch.where(kinds < 0.35, pieces, tokens)
+    tokens = torch.where((kinds >= 0.35) & (kinds < 0.5), END_OF_PADDING_ID, tokens)
+    tokens = torch.where(
+        (kinds >= 0.5) & (kinds < 0.5 + eos_rate), tokenizer.eos_id(), tokens
+    )
+    return tokens
+
+
+def timestamps(tokens, tokenizer):
+    return batch_tokens_to_timestamped_text(
+        tokens,
+        tokenizer,
+        FRAME_RATE,
+        END_OF_PADDING_ID,
+        PADDING_TOKEN_ID,
+        OFFSET_SECONDS,
+    )
+
+
+def reference(row, tokenizer):
+    return reference_tokens_to_timestamped_text(
+        row, tokenizer, FRAME_RATE, END_OF_PADDING_ID, PADDING_TOKEN_ID, OFFSET_SECONDS
+    )
+
+
+@pytest.mark.parametrize("eos_rate", [0.0, 0.02, 0.1])
+@pytest.mark.parametrize("seed", range(5))
+def test_batch_matches_reference_loop(tokenizer, seed, eos_rate):
+    generator = torch.Generator().manual_seed(seed)
+    tokens = random_tokens(generator, tokenizer, 6, 80, eos_rate)
+    # An empty row and a row without any boundary.
+    tokens[0] = PADDING_TOKEN_ID
+    tokens[1][tokens[1] == END_OF_PADDING_ID] = PADDING_TOKEN_ID
+    expected = [reference(row, tokenizer) for row in tokens]
+    assert any(len(words) > 1 for words in expected)
+    assert timestamps(tokens, tokenizer) == expected
+    # `[B, 1, T]` rows as returned by `streaming_transcribe`.
+    assert timestamps(tokens[:, None], tokenizer) == expected
+
+
+def test_last_segment_fallback_end(tokenizer):
+    # No EOS after the last boundary: the last word ends one second (floored to
+    # a frame) after it, or at the end of the row if that comes first.
+    piece = tokenizer.piece_to_id("▁the")
+    tokens = torch.full((2, 40), PADDING_TOKEN_ID)
+    tokens[0, 5] = END_OF_PADDING_ID
+    tokens[0, 6] = piece
+    tokens[1, 35] = END_OF_PADDING_ID
+    tokens[1, 36] = piece
+    expected = [reference(row, tokenizer) for row in tokens]
+    assert timestamps(tokens, tokenizer) == expected
+    ((first,), (second,)) = expected
+    assert (
+        first.timestamp[1] == (6 + math.floor(FRAME_RATE)) / FRAME_RATE - OFFSET_SECONDS
+    )
+    assert second.timestamp[1] == 40 / FRAME_RATE - OFFSET_SECONDS
+
+
+def test_last_segment_ends_at_first_eos(tokenizer):
+    piece = tokenizer.piece_to_id("▁the")
+    tokens = torch.full((30,), PADDING_TOKEN_ID)
+    tokens[[2, 9]] = END_OF_PADDING_ID
+    tokens[[3, 10]] = piece
+    tokens[[14, 20]] = tokenizer.eos_id()
+    expected = reference(tokens, tokenizer)
+    assert [word.timestamp[1] for word in expected] == [
+        9 / FRAME_RATE - OFFSET_SECONDS,
+        14 / FRAME_RATE - OFFSET_SECONDS,
+    ]
+    assert (
+        tokens_to_timestamped_text(
+            tokens,
+            tokenizer,
+            FRAME_RATE,
+            END_OF_PADDING_ID,
+            PADDING_TOKEN_ID,
+            OFFSET_SECONDS,
+        )
+        == expected
+    )
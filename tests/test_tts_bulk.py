@@ -0,0 +1,65 @@
+import argparse
+import os
+import queue
+import sys
+
+import pytest
+from conftest import N_Q, make_tts_model, voice_embedding
+from safetensors.torch import save_file
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+import tts_bulk  # noqa: E402
+
+
+@pytest.fixture
+def voices(tmp_path):
+    paths = {}
+    for name, seed in (("alice", 1), ("bob", 2)):
+        path = tmp_path / f"{name}.safetensors"
+        save_file({"speaker_wavs": voice_embedding(seed)}, str(path))
+        paths[name] = str(path)
+    return paths
+
+
+def test_worker_keeps_each_item_voice(tmp_path, voices, monkeypatch):
+    monkeypatch.setattr(
+        tts_bulk, "load_model", lambda device, args: make_tts_model(temp=args.temp)
+    )
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    args = argparse.Namespace(
+        batch_size=2,
+        compile=False,
+        temp=0.0,
+        voice=voices["alice"],
+        cfg_coef=1.0,
+        decode_chunk_frames=64,
+        out_dir=str(out_dir),
+    )
+    # Same text throughout, so items only differ by voice. With two slots the
+    # second pair lands in the rows the first pair used, the other way round.
+    names = ["alice", "bob", "bob", "alice"]
+    items = [
+        {
+            "id": f"{i}-{name}",
+            "text": "hello world",
+            "voice": voices[name],
+            "params": {"n_q": N_Q},
+        }
+        for i, name in enumerate(names)
+    ]
+    results = queue.Queue()
+    tts_bulk.worker(0, "cpu", items, args, results)
+
+    statuses = {}
+    while (result := results.get_nowait()) is not None:
+        statuses[result["id"]] = result["status"]
+    assert statuses == {item["id"]: "ok" for item in items}
+
+    audio = {}
+    for item in items:
+        with open(out_dir / f"{item['id']}.wav", "rb") as f:
+            audio[item["id"]] = f.read()
+    assert audio["0-alice"] != audio["1-bob"]
+    assert audio["0-alice"] == audio["3-alice"]
+    assert audio["1-bob"] == audio["2-bob"]
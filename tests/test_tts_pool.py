@@ -0,0 +1,110 @@
+import time
+
+import pytest
+import torch
+from conftest import make_tts_model, voice_embedding
+
+from gpu_manager import GPUManager
+from tts_pool import TTSPool
+
+
+def _load(device):
+    return make_tts_model(device=device)
+
+
+def _submit(replica, text="hello world", text_open=False):
+    scheduler = replica.get_scheduler()
+    tts_model = scheduler.tts_model
+    condition = replica.voice_cache.get(
+        tts_model, "voice-1", 1.0, embedding=voice_embedding(1)
+    )
+    entries = tts_model.prepare_script([text], padding_between=1)
+    return scheduler.submit(
+        entries,
+        condition.attributes,
+        condition.condition_tensors,
+        text_open=text_open,
+    )
+
+
+def _wait_for(predicate, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def pool():
+    pool = TTSPool(
+        [GPUManager(device="cpu"), GPUManager(device="cpu")],
+        _load,
+        max_batch_size=2,
+    )
+    yield pool
+    for replica in pool.replicas:
+        replica.stop()
+
+
+def test_routes_to_least_loaded_replica(pool):
+    first, second = pool.replicas
+    # Nothing loaded yet: ties go to the first replica.
+    assert pool.route() is first
+    _submit(first).wait()
+    # Still a tie on load, but the first one is already resident.
+    assert pool.route() is first
+
+    # An open job keeps its row busy until it is closed or cancelled.
+    job = _submit(first, text_open=True)
+    assert first.load == 1
+    assert pool.route() is second
+    frames = _submit(pool.route()).wait()
+    assert torch.cat(frames, dim=-1).shape[0] == 1
+    assert second.manager.state == "resident"
+    job.cancel()
+    _wait_for(lambda: first.load == 0)
+
+
+def test_drain_finishes_work_then_offloads(pool):
+    first, second = pool.replicas
+    job = _submit(first, text_open=True)
+    first.manager.drain(mode="cold")
+    # A draining replica gets no new work, however loaded the others are.
+    assert pool.route() is second
+    _submit(second, text_open=True)
+    assert pool.route() is second
+    # It keeps its model until the running job is done.
+    time.sleep(0.3)
+    assert first.manager.state == "resident"
+    assert first.scheduler is not None
+
+    job.cancel()
+    _wait_for(lambda: first.manager.state == "cold")
+    assert first.scheduler is None
+    assert first.manager.offload_count == 1
+
+    second.manager.drain(mode="cold")
+    with pytest.raises(RuntimeError):
+        pool.route()
+
+
+def test_offload_and_resume(pool):
+    first, _ = pool.replicas
+    before = torch.cat(_submit(first).wait(), dim=-1)
+    scheduler = first.scheduler
+    # Standby parks weights in pinned memory, which only makes sense on a GPU.
+    assert not first.manager.offload()
+    assert first.manager.state == "resident"
+
+    first.manager.drain(mode="cold")
+    _wait_for(lambda: first.manager.state == "cold")
+    assert first.scheduler is None
+    assert scheduler._stopped.is_set()
+
+    first.manager.resume()
+    assert pool.route() is first
+    after = torch.cat(_submit(first).wait(), dim=-1)
+    assert first.manager.state == "resident"
+    assert first.manager.load_count == 2
+    assert first.scheduler is not scheduler
+    assert after.shape[0] == before.shape[0]
@@ -0,0 +1,78 @@
+import torch
+from conftest import make_tts_model, voice_embedding
+from moshi.modules.transformer import StreamingMultiheadAttention
+
+from tts_scheduler import TTSScheduler
+from voice_cache import VoiceConditionCache
+
+
+def _condition(tts_model, cache, seed):
+    return cache.get(tts_model, f"voice-{seed}", 1.0, embedding=voice_embedding(seed))
+
+
+def _submit(scheduler, cache, seed, text="hello world"):
+    tts_model = scheduler.tts_model
+    condition = _condition(tts_model, cache, seed)
+    entries = tts_model.prepare_script([text], padding_between=1)
+    return scheduler.submit(entries, condition.attributes, condition.condition_tensors)
+
+
+def _tokens(job):
+    return torch.cat(job.wait(), dim=-1)
+
+
+def _cross_keys(tts_model, index):
+    return [
+        module._streaming_state.k_cross[index].clone()
+        for module in tts_model.lm.transformer.modules()
+        if isinstance(module, StreamingMultiheadAttention) and module.cross_attention
+    ]
+
+
+def test_voice_swap_recomputes_cross_attention():
+    tts_model = make_tts_model(temp=0.0)
+    cache = VoiceConditionCache()
+    scheduler = TTSScheduler(tts_model, max_batch_size=2)
+    try:
+        first = _tokens(_submit(scheduler, cache, seed=1))
+        first_keys = _cross_keys(tts_model, 0)
+        # Same row, same LMGen, another voice.
+        second = _tokens(_submit(scheduler, cache, seed=2))
+        second_keys = _cross_keys(tts_model, 0)
+    finally:
+        scheduler.stop()
+    assert first_keys
+    for first_key, second_key in zip(first_keys, second_keys):
+        assert not torch.equal(first_key, second_key)
+    assert not torch.equal(first, second)
+
+    # The second job speaks as if the LMGen had been built for its own voice.
+    scheduler = TTSScheduler(tts_model, max_batch_size=2)
+    try:
+        fresh = _tokens(_submit(scheduler, cache, seed=2))
+    finally:
+        scheduler.stop()
+    assert torch.equal(second, fresh)
+
+
+def test_admission_keeps_running_rows_in_sync():
+    tts_model = make_tts_model(temp=0.0, max_gen_length=200)
+    cache = VoiceConditionCache()
+    scheduler = TTSScheduler(tts_model, max_batch_size=2)
+    try:
+        alone = _tokens(_submit(scheduler, cache, seed=1, text="one two three four"))
+    finally:
+        scheduler.stop()
+
+    scheduler = TTSScheduler(tts_model, max_batch_size=2)
+    try:
+        running = _submit(scheduler, cache, seed=1, text="one two three four")
+        # Let the first row get going, then admit a second job next to it.
+        while running.audio_frames < 2 and not running.done.is_set():
+            running.done.wait(0.01)
+        joined = _submit(scheduler, cache, seed=2)
+        together = _tokens(running)
+        joined.wait()
+    finally:
+        scheduler.stop()
+    assert torch.equal(alone, together)
@@ -0,0 +1,36 @@
+from conftest import voice_embedding
+
+from voice_cache import VoiceConditionCache
+
+
+def _get(cache, tts_model, seed):
+    return cache.get(tts_model, f"voice-{seed}", 1.0, embedding=voice_embedding(seed))
+
+
+def _tensor_bytes(*tensors):
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def test_entry_counts_voice_embedding(tts_model):
+    cache = VoiceConditionCache()
+    entry = _get(cache, tts_model, 1)
+    voice = entry.attributes.tensor["speaker_wavs"]
+    expected = _tensor_bytes(voice.tensor, voice.mask) + sum(
+        _tensor_bytes(*condition) for condition in entry.condition_tensors.values()
+    )
+    assert entry.nbytes == expected
+    assert cache.stats()["bytes"] == entry.nbytes
+
+
+def test_evicts_least_recently_used_at_budget(tts_model):
+    entry_bytes = _get(VoiceConditionCache(), tts_model, 1).nbytes
+    cache = VoiceConditionCache(max_bytes=2 * entry_bytes)
+    _get(cache, tts_model, 1)
+    _get(cache, tts_model, 2)
+    assert cache.stats()["evictions"] == 0
+    _get(cache, tts_model, 1)
+    _get(cache, tts_model, 3)
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == 2 * entry_bytes
+    assert [key[0] for key in cache.entries] == ["voice-1", "voice-3"]
@@ -0,0 +1,135 @@
+import functools
+import threading
+
+import torch
+
+from metrics import stage
+from tts_scheduler import TTSScheduler
+from voice_cache import VoiceConditionCache
+
+
+class TTSReplica:
+    """One model replica: its GPUManager, batch scheduler and voice cache."""
+
+    def __init__(
+        self,
+        index,
+        manager,
+        load_func,
+        max_batch_size=8,
+        voice_cache_bytes=256 * 1024**2,
+        compile=False,
+        max_queue=64,
+    ):
+        self.index = index
+        self.manager = manager
+        self.load_func = functools.partial(load_func, manager.device)
+        self.max_batch_size = max_batch_size
+        self.compile = compile
+        self.max_queue = max_queue
+        self.voice_cache = VoiceConditionCache(max_bytes=voice_cache_bytes)
+        self.scheduler = None
+        self.lock = threading.Lock()
+        manager.offload_callbacks.append(self.stop)
+        manager.busy_checks.append(lambda: self.load > 0)
+
+    @property
+    def device(self):
+        return self.manager.device
+
+    @property
+    def load(self):
+        scheduler = self.scheduler
+        if scheduler is None:
+            return 0
+        return scheduler.active + scheduler.queue_depth
+
+    def get_model(self):
+        with stage("get_model"):
+            return self.manager.get_model(self.load_func)
+
+    def get_scheduler(self):
+        tts_model = self.get_model()
+        with self.lock:
+            if self.scheduler is None or self.scheduler.tts_model is not tts_model:
+                if self.scheduler is not None:
+                    self.scheduler.stop()
+                # Cached condition tensors live on the previous model's device.
+                self.voice_cache.clear()
+                self.scheduler = TTSScheduler(
+                    tts_model,
+                    max_batch_size=self.max_batch_size,
+                    compile=self.compile,
+                    max_queue=self.max_queue,
+                )
+            return self.scheduler
+
+    def stop(self):
+        with self.lock:
+            if self.scheduler is not None:
+                self.scheduler.stop()
+                self.scheduler = None
+            self.voice_cache.clear()
+
+    def status(self):
+        status = {
+            "index": self.index,
+            "load": self.load,
+            "batch_active": self.scheduler.active if self.scheduler is not None else 0,
+            "queue_depth": self.scheduler.queue_depth
+            if self.scheduler is not None
+            else 0,
+            **self.manager.status(),
+        }
+        if str(self.device).startswith("cuda") and torch.cuda.is_available():
+            device = torch.device(self.device)
+            status["memory_used_gb"] = round(
+                torch.cuda.memory_allocated(device) / 1024**3, 2
+            )
+            status["memory_total_gb"] = round(
+                torch.cuda.get_device_properties(device).total_memory / 1024**3, 2
+            )
+        return status
+
+
+class TTSPool:
+    """Routes each request to the replica with the shortest queue."""
+
+    def __init__(
+        self,
+        managers,
+        load_func,
+        max_batch_size=8,
+        voice_cache_bytes=256 * 1024**2,
+        compile=False,
+        max_queue=64,
+    ):
+        self.replicas = [
+            TTSReplica(
+                i,
+                manager,
+                load_func,
+                max_batch_size,
+                voice_cache_bytes,
+                compile,
+                max_queue,
+            )
+            for i, manager in enumerate(managers)
+        ]
+
+    def route(self):
+        candidates = [r for r in self.replicas if not r.manager.draining]
+        if not candidates:
+            raise RuntimeError("All model replicas are draining")
+        # On ties prefer a replica that is already resident over waking one up.
+        return min(candidates, key=lambda r: (r.load, r.manager.state != "resident"))
+
+    def invalidate_voice(self, voice_path):
+        for replica in self.replicas:
+            replica.voice_cache.invalidate(voice_path)
+
+    def voice_cache_stats(self):
+        return [replica.voice_cache.stats() for replica in self.replicas]
+
+    def status(self):
+        return [replica.status() for replica in self.replicas]
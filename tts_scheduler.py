@@ -0,0 +1,684 @@
+import copy
+import itertools
+import math
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import torch
+from moshi.models.lm import LMGen
+from moshi.modules.transformer import StreamingMultiheadAttention
+
+from metrics import (
+    JOBS,
+    REAL_TIME_FACTOR,
+    SHED,
+    STAGE_SECONDS,
+    STEP_SECONDS,
+    TIER_SWITCHES,
+    stage,
+)
+from tts_step import compile_lm_gen, needs_sampled_token
+
+
+# Admission classes, lower is served first.
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class Overloaded(RuntimeError):
+    """A job was shed by admission control.
+
+    `status` is the HTTP status to answer with (503 for interactive jobs, 429
+    for batch ones, which are expected to back off) and `retry_after` the
+    estimated seconds until the queue could take the job.
+    """
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def decode_frames(mimi, frames, chunk_frames=64):
+    """Decode a fully generated utterance in a few large Mimi calls.
+
+    Same streaming decoder state as the frame-by-frame loop, but `chunk_frames`
+    frames per call and a single clip + host copy at the end.
+    """
+    if not frames:
+        return np.zeros(0, dtype=np.float32)
+    with stage("decode"):
+        codes = torch.cat(frames, dim=-1)[:, 1:, :]
+        pcms = []
+        with mimi.streaming(1), torch.no_grad():
+            for start in range(0, codes.shape[-1], chunk_frames):
+                pcms.append(mimi.decode(codes[..., start : start + chunk_frames]))
+        return torch.cat(pcms, dim=-1).clamp(-1, 1)[0, 0].cpu().numpy()
+
+
+@dataclass
+class TTSJob:
+    entries: list
+    condition_attributes: object
+    condition_tensors: dict | None = None
+    stream: bool = False
+    frames: list = field(default_factory=list)
+    chunks: queue.Queue = field(default_factory=queue.Queue)
+    error: Exception | None = None
+    cancelled: bool = False
+    done: threading.Event = field(default_factory=threading.Event)
+    # Called from the scheduler thread with each PCM chunk and then with None
+    # once the job is finished; replaces `chunks`/`done` polling for callers
+    # that cannot block a thread per job (the ASGI server).
+    listener: object = None
+    # Incremental jobs keep accepting text after submission (see `append_entries`).
+    text_open: bool = False
+    incoming: queue.Queue = field(default_factory=queue.Queue)
+    # Audio codebooks to generate; None means the model's `n_q`.
+    n_q: int | None = None
+    priority: int = PRIORITIES["interactive"]
+    # Submission order, breaks priority ties in the pending queue.
+    seq: int = 0
+    # perf_counter timestamps and the number of audio frames, for metrics.
+    submitted_at: float = field(default_factory=time.perf_counter)
+    admitted_at: float | None = None
+    finished_at: float | None = None
+    audio_frames: int = 0
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError("TTS job did not finish in time")
+        if self.error is not None:
+            raise self.error
+        return self.frames
+
+    def iter_pcm(self):
+        """Yield decoded float PCM chunks of streaming jobs as they are generated."""
+        while True:
+            pcm = self.chunks.get()
+            if pcm is None:
+                break
+            yield pcm
+        if self.error is not None:
+            raise self.error
+
+    def append_entries(self, entries):
+        self.incoming.put(list(entries))
+
+    def close_text(self):
+        self.incoming.put(None)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def publish(self, pcm):
+        if self.listener is not None:
+            self.listener(pcm)
+        else:
+            self.chunks.put(pcm)
+
+    def finish(self, error=None):
+        self.error = error
+        # Set before `done`, so it is there as soon as `wait` returns.
+        self.finished_at = time.perf_counter()
+        self.done.set()
+        if self.listener is not None:
+            self.listener(None)
+        elif self.stream:
+            self.chunks.put(None)
+
+
+@dataclass
+class _Slot:
+    job: TTSJob
+    state: object
+    offset: int = 0
+    decoding: bool = False
+    text_open: bool = False
+    paused: bool = False
+
+    def pull_text(self):
+        while True:
+            try:
+                entries = self.job.incoming.get_nowait()
+            except queue.Empty:
+                return
+            if entries is None:
+                self.text_open = False
+            else:
+                self.state.entries.extend(entries)
+
+
+class TTSScheduler:
+    """Continuous batching of TTS jobs over one resident TTSModel.
+
+    A single worker thread owns the LMGen streaming state with `max_batch_size`
+    rows. Jobs are admitted into free rows at frame boundaries (the row is reset
+    and its voice conditioning swapped in) and retired as soon as their script
+    is fully spoken, without stalling the other rows.
+
+    Streaming jobs are decoded in the same loop by a private copy of Mimi, so
+    their PCM is available one frame after it is generated.
+
+    Jobs may ask for fewer audio codebooks (`n_q`) than the model generates by
+    default. The depformer runs one step per codebook for the whole batch, so a
+    batch holds a single `n_q`: a job for another one waits at the head of the
+    queue until the running batch drains, then the LMGen is rebuilt for it.
+
+    Pending jobs are served by priority class, then in submission order. At
+    most `max_queue` jobs wait, of which batch jobs may take `BATCH_QUEUE_SHARE`,
+    so a flood of offline work always leaves room for interactive requests;
+    beyond that, or when the estimated wait exceeds a job's deadline, `submit`
+    raises `Overloaded`.
+    """
+
+    BATCH_QUEUE_SHARE = 0.5
+
+    def __init__(self, tts_model, max_batch_size=8, compile=False, max_queue=64):
+        if tts_model.cfg_coef != 1.0:
+            raise ValueError(
+                "The scheduler only supports CFG-distilled models, "
+                "pass `cfg_coef` to `make_condition_attributes` instead."
+            )
+        self.tts_model = tts_model
+        self.max_batch_size = max_batch_size
+        self.compile = compile
+        self.max_queue = max_queue
+        # (priority, seq, job) tuples.
+        self.pending = queue.PriorityQueue()
+        self._seq = itertools.count()
+        # Moving average of a job's time in the batch, for wait estimates.
+        self._job_seconds = None
+        self.slots = [None] * max_batch_size
+        self.lm_gen = None
+        self.n_q = None
+        # A job taken from `pending` that waits for the batch to switch `n_q`.
+        self._held = None
+        self._input_tokens = None
+        self._paused = None
+        self.mimi = None
+        self._stopped = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="tts-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def active(self):
+        return sum(slot is not None for slot in self.slots)
+
+    @property
+    def queue_depth(self):
+        return self.pending.qsize() + (self._held is not None)
+
+    def queue_depth_by_priority(self):
+        depths = dict.fromkeys(PRIORITIES.values(), 0)
+        with self.pending.mutex:
+            for priority, _, _ in self.pending.queue:
+                depths[priority] += 1
+        held = self._held
+        if held is not None:
+            depths[held.priority] += 1
+        return {name: depths[priority] for name, priority in PRIORITIES.items()}
+
+    def estimate_wait(self, priority):
+        """Rough seconds until a job of `priority` submitted now gets a batch row.
+
+        Jobs ahead of it are admitted `max_batch_size` at a time as rows free up,
+        each wave taking about as long as recent jobs did.
+        """
+        depths = self.queue_depth_by_priority()
+        ahead = sum(
+            depths[name] for name, p in PRIORITIES.items() if p <= PRIORITIES[priority]
+        )
+        free = self.max_batch_size - self.active
+        if ahead < free or self._job_seconds is None:
+            return 0.0
+        return ((ahead - free) // self.max_batch_size + 1) * self._job_seconds
+
+    def _admission_check(self, name, deadline):
+        interactive = name == "interactive"
+        status = 503 if interactive else 429
+        depths = self.queue_depth_by_priority()
+        full = sum(depths.values()) >= self.max_queue
+        if not interactive:
+            full = full or depths[name] >= int(self.max_queue * self.BATCH_QUEUE_SHARE)
+        wait = self.estimate_wait(name)
+        retry_after = max(1, math.ceil(wait))
+        if full:
+            SHED.labels(name, "queue_full").inc()
+            raise Overloaded(
+                f"TTS queue is full for {name} requests", status, retry_after
+            )
+        if deadline is not None and wait > deadline:
+            SHED.labels(name, "deadline").inc()
+            raise Overloaded(
+                f"Estimated wait of {wait:.1f}s exceeds the {deadline:g}s deadline",
+                status,
+                retry_after,
+            )
+
+    @property
+    def max_n_q(self):
+        # One depformer output head per codebook it can generate.
+        return len(self.tts_model.lm.linears)
+
+    def submit(
+        self,
+        entries,
+        condition_attributes,
+        condition_tensors=None,
+        stream=False,
+        listener=None,
+        text_open=False,
+        n_q=None,
+        priority="interactive",
+        deadline=None,
+        check_admission=True,
+    ):
+        """Queue a job. With `text_open`, more entries can be added with
+        `job.append_entries` until `job.close_text` is called.
+
+        `priority` is a key of `PRIORITIES`; `deadline` is the most seconds the
+        caller is willing to wait for the job to start. Raises `Overloaded`
+        when the job is shed. Follow-up jobs of a request whose first job was
+        already admitted pass `check_admission=False`, so a request is never
+        shed by its own earlier jobs."""
+        if self._stopped.is_set():
+            raise RuntimeError("TTS scheduler is stopped")
+        if n_q is not None and not 1 <= n_q <= self.max_n_q:
+            raise ValueError(f"n_q must be between 1 and {self.max_n_q}, got {n_q}")
+        if priority not in PRIORITIES:
+            raise ValueError(
+                f"Unknown priority '{priority}', expected one of {sorted(PRIORITIES)}"
+            )
+        if check_admission:
+            self._admission_check(priority, deadline)
+        JOBS.labels(str(self.tts_model.n_q if n_q is None else n_q)).inc()
+        job = TTSJob(
+            entries,
+            condition_attributes,
+            condition_tensors=condition_tensors,
+            stream=stream,
+            listener=listener,
+            text_open=text_open,
+            n_q=n_q,
+            priority=PRIORITIES[priority],
+            seq=next(self._seq),
+        )
+        self.pending.put((job.priority, job.seq, job))
+        self._wakeup.set()
+        return job
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        if self._held is not None:
+            self._held.finish(RuntimeError("TTS scheduler stopped"))
+            self._held = None
+        while True:
+            try:
+                self.pending.get_nowait()[2].finish(
+                    RuntimeError("TTS scheduler stopped")
+                )
+            except queue.Empty:
+                break
+
+    def _run(self):
+        with torch.no_grad():
+            while not self._stopped.is_set():
+                if self.active == 0 and self._held is None and self.pending.empty():
+                    self._wakeup.wait(0.1)
+                    self._wakeup.clear()
+                    continue
+                try:
+                    self._retire()
+                    self._admit()
+                    if self.active:
+                        self._step()
+                except Exception as e:
+                    self._fail_active(e)
+            self._fail_active(RuntimeError("TTS scheduler stopped"))
+
+    def _condition_tensors(self, attributes):
+        provider = self.tts_model.lm.condition_provider
+        assert provider is not None
+        return provider(provider.prepare(attributes))
+
+    def _build_lm_gen(self, condition_attributes, n_q):
+        tts_model = self.tts_model
+        machine = tts_model.machine
+        condition_tensors = self._condition_tensors(
+            [condition_attributes] * self.max_batch_size
+        )
+
+        def _on_text_logits_hook(text_logits):
+            if tts_model.padding_bonus:
+                text_logits[..., machine.token_ids.pad] += tts_model.padding_bonus
+            return text_logits
+
+        # Codebook q of a row is zeroed until its offset reaches audio_thresholds[q].
+        audio_delays = tts_model.lm.delays[tts_model.lm.audio_offset :]
+        audio_thresholds = torch.tensor(
+            [delay + tts_model.delay_steps for delay in audio_delays],
+            device=tts_model.lm.device,
+        )
+        max_threshold = max(audio_delays) + tts_model.delay_steps
+
+        def _on_audio_hook(audio_tokens):
+            offsets = [
+                max_threshold if slot is None else slot.offset for slot in self.slots
+            ]
+            if min(offsets) >= max_threshold:
+                return
+            offsets = torch.tensor(offsets, device=audio_tokens.device)
+            mask = offsets[:, None] < audio_thresholds[None, : audio_tokens.shape[1]]
+            audio_tokens.masked_fill_(mask, machine.token_ids.zero)
+
+        def _on_text_hook(text_tokens):
+            active = [
+                (b, slot)
+                for b, slot in enumerate(self.slots)
+                if slot is not None and not slot.paused
+            ]
+            # At most one host copy for the whole batch, and none on steps where
+            # every row's transition is forced anyway.
+            tokens = None
+            if any(needs_sampled_token(slot.state) for _, slot in active):
+                tokens = text_tokens.tolist()
+            out_tokens = [machine.token_ids.pad] * len(self.slots)
+            for b, slot in active:
+                token = machine.token_ids.pad if tokens is None else tokens[b]
+                out_tokens[b], _ = machine.process(slot.offset, slot.state, token)
+            text_tokens.copy_(torch.tensor(out_tokens, dtype=torch.long))
+
+        tts_model.lm.dep_q = n_q
+        lm_gen = LMGen(
+            tts_model.lm,
+            temp=tts_model.temp,
+            temp_text=tts_model.temp,
+            cfg_coef=tts_model.cfg_coef,
+            condition_tensors=condition_tensors,
+            on_text_logits_hook=_on_text_logits_hook,
+            on_text_hook=_on_text_hook,
+            on_audio_hook=_on_audio_hook,
+            cfg_is_masked_until=None,
+            cfg_is_no_text=True,
+            # Rows are reset one at a time as jobs join; without this LMGen
+            # holds back the whole batch until the new row's delays elapse.
+            support_out_of_sync=True,
+        )
+        lm_gen.streaming_forever(self.max_batch_size)
+        if self.compile:
+            compile_lm_gen(lm_gen)
+        # The TTS model has no user audio stream, but LMGen still wants an
+        # input tensor; it is only read, so one buffer serves every step.
+        self._input_tokens = torch.full(
+            (self.max_batch_size, tts_model.lm.n_q - tts_model.lm.dep_q, 1),
+            machine.token_ids.zero,
+            dtype=torch.long,
+            device=tts_model.lm.device,
+        )
+        return lm_gen
+
+    def _set_slot_condition(self, index, job):
+        # The fused conditions live in the LMGen streaming state, one row per
+        # slot, so swapping a voice is a row copy rather than a rebuild.
+        state = self.lm_gen._streaming_state
+        fuser = self.tts_model.lm.fuser
+        condition_tensors = job.condition_tensors
+        if condition_tensors is None:
+            condition_tensors = self._condition_tensors([job.condition_attributes])
+        condition_sum = fuser.get_sum(condition_tensors)
+        condition_cross = fuser.get_cross(condition_tensors)
+        if condition_sum is not None:
+            state.condition_sum[index] = condition_sum[0].to(state.condition_sum.dtype)
+        if condition_cross is not None:
+            if condition_cross.shape[1:] != state.condition_cross.shape[1:]:
+                raise ValueError(
+                    "Voice embedding shape does not match the running batch"
+                )
+            state.condition_cross[index] = condition_cross[0].to(
+                state.condition_cross.dtype
+            )
+            self._set_slot_cross_attention(index, state.condition_cross)
+
+    def _set_slot_cross_attention(self, index, condition_cross):
+        # Cross-attention layers cache their keys and values on the first step
+        # and a row reset does not clear them, so the row's entries have to be
+        # recomputed from its new conditions.
+        src = condition_cross[index : index + 1]
+        for module in self.tts_model.lm.transformer.modules():
+            if not isinstance(module, StreamingMultiheadAttention):
+                continue
+            mha_state = module._streaming_state
+            if not module.cross_attention or mha_state is None:
+                continue
+            if mha_state.k_cross is None:
+                # Not cached yet: the first step computes it for every row.
+                continue
+            k, v = module._compute_cross_attention(src, src)
+            mha_state.k_cross[index] = k[0]
+            mha_state.v_cross[index] = v[0]
+
+    def _admit(self):
+        free = [i for i, slot in enumerate(self.slots) if slot is None]
+        admitted = []
+        while free:
+            job = self._next_job()
+            if job is None:
+                break
+            if job.cancelled:
+                job.finish()
+                continue
+            if job.n_q is None:
+                job.n_q = self.tts_model.n_q
+            if self.lm_gen is not None and job.n_q != self.n_q:
+                if self.active or admitted:
+                    # Keep queue order: nothing behind this job is admitted
+                    # until the batch has drained and switched over to it.
+                    self._held = job
+                    break
+                self._release_lm_gen()
+                TIER_SWITCHES.inc()
+            if self.lm_gen is None:
+                try:
+                    self.lm_gen = self._build_lm_gen(job.condition_attributes, job.n_q)
+                    self.n_q = job.n_q
+                except Exception as e:
+                    job.finish(e)
+                    continue
+            index = free.pop(0)
+            admitted.append((index, job))
+        if not admitted:
+            return
+        reset_mask = torch.zeros(
+            self.max_batch_size, dtype=torch.bool, device=self.tts_model.lm.device
+        )
+        for index, _ in admitted:
+            reset_mask[index] = True
+        self.lm_gen.reset_streaming(reset_mask)
+        # Resetting re-enables the rows, so the exec mask has to be set again.
+        self._paused = None
+        for index, job in admitted:
+            try:
+                self._set_slot_condition(index, job)
+            except Exception as e:
+                job.finish(e)
+                continue
+            self.slots[index] = _Slot(
+                job,
+                self.tts_model.machine.new_state(job.entries),
+                text_open=job.text_open,
+            )
+            job.admitted_at = time.perf_counter()
+            STAGE_SECONDS.labels("queue_wait").observe(
+                job.admitted_at - job.submitted_at
+            )
+
+    def _next_job(self):
+        held = self._held
+        if held is not None:
+            # A held job only blocks jobs of its own class and below; a more
+            # urgent arrival goes first and the held job back in the queue.
+            with self.pending.mutex:
+                overtaken = (
+                    bool(self.pending.queue)
+                    and self.pending.queue[0][0] < held.priority
+                )
+            if not overtaken:
+                self._held = None
+                return held
+            self._held = None
+            self.pending.put((held.priority, held.seq, held))
+        try:
+            return self.pending.get_nowait()[2]
+        except queue.Empty:
+            return None
+
+    def _retire(self):
+        tts_model = self.tts_model
+        for index, slot in enumerate(self.slots):
+            if slot is None:
+                continue
+            end_step = slot.state.end_step
+            finished = (
+                end_step is not None
+                and slot.offset
+                >= end_step + tts_model.delay_steps + tts_model.final_padding
+            )
+            if (
+                finished
+                or slot.job.cancelled
+                or slot.offset >= tts_model.max_gen_length
+            ):
+                self.slots[index] = None
+                self._observe_finished(slot.job)
+                slot.job.finish()
+
+    def _observe_finished(self, job):
+        # Incremental jobs spend part of their time waiting for text, which
+        # would skew these numbers.
+        if job.text_open or job.cancelled:
+            return
+        elapsed = time.perf_counter() - job.admitted_at
+        STAGE_SECONDS.labels("generate").observe(elapsed)
+        if self._job_seconds is None:
+            self._job_seconds = elapsed
+        else:
+            self._job_seconds = 0.8 * self._job_seconds + 0.2 * elapsed
+        if job.audio_frames:
+            REAL_TIME_FACTOR.observe(
+                elapsed * self.tts_model.mimi.frame_rate / job.audio_frames
+            )
+
+    def _starved(self, slot):
+        # Same lookahead `TTSGen.process` keeps before stepping.
+        return (
+            slot.text_open
+            and len(slot.state.entries) <= self.tts_model.machine.second_stream_ahead
+        )
+
+    def _update_paused(self):
+        # Rows waiting for more text are left out of the step through the LM
+        # exec mask: their caches and offsets stay put, so they resume where
+        # they stopped instead of running out of words and ending.
+        paused = []
+        for slot in self.slots:
+            if slot is not None and slot.text_open:
+                slot.pull_text()
+            if slot is not None:
+                slot.paused = self._starved(slot)
+            paused.append(slot is not None and slot.paused)
+        if paused != self._paused:
+            self._paused = paused
+            exec_mask = torch.tensor(
+                [not p for p in paused],
+                dtype=torch.bool,
+                device=self.tts_model.lm.device,
+            )
+            self.lm_gen.set_exec_mask(exec_mask)
+
+    def _step(self):
+        start = time.perf_counter()
+        self._update_paused()
+        frame = self.lm_gen.step(self._input_tokens)
+        for slot in self.slots:
+            if slot is not None and not slot.paused:
+                slot.offset += 1
+        if frame is None:
+            STEP_SECONDS.labels("lm").observe(time.perf_counter() - start)
+            return
+        # Rows only carry audio once their own delays have elapsed (rows still
+        # warming up after a reset come back as -1), which drops the same
+        # leading frames as `result.frames[delay_steps:]`.
+        # The host copy also waits for the step, so the timing below is real.
+        valid = (frame[:, 1:, 0] >= 0).all(dim=1).tolist()
+        STEP_SECONDS.labels("lm").observe(time.perf_counter() - start)
+        streaming = []
+        for b, slot in enumerate(self.slots):
+            if slot is None or not valid[b]:
+                continue
+            slot.job.audio_frames += 1
+            if slot.job.stream:
+                streaming.append(b)
+            else:
+                slot.job.frames.append(frame[b : b + 1].clone())
+        if streaming:
+            self._decode(frame, streaming)
+
+    def _decode(self, frame, rows):
+        # One batched Mimi step; rows that are not decoding this frame are
+        # masked out so their decoder state is untouched. A row is reset right
+        # before its first real frame.
+        start = time.perf_counter()
+        if self.mimi is None:
+            self.mimi = copy.deepcopy(self.tts_model.mimi)
+            # The shared Mimi may be mid-decode in a request thread
+            # (`decode_frames`); drop any streaming state that came along.
+            self.mimi._stop_streaming()
+            self.mimi.streaming_forever(self.max_batch_size)
+        starting = [b for b in rows if not self.slots[b].decoding]
+        if starting:
+            reset_mask = torch.zeros(
+                self.max_batch_size, dtype=torch.bool, device=frame.device
+            )
+            reset_mask[starting] = True
+            self.mimi.reset_streaming(reset_mask)
+            for b in starting:
+                self.slots[b].decoding = True
+        exec_mask = torch.zeros(
+            self.max_batch_size, dtype=torch.bool, device=frame.device
+        )
+        exec_mask[rows] = True
+        self.mimi.set_exec_mask(exec_mask)
+        codes = frame[:, 1:, :].clamp(min=0)
+        pcm = self.mimi.decode(codes).clamp(-1, 1).cpu().numpy()
+        STEP_SECONDS.labels("mimi").observe(time.perf_counter() - start)
+        for b in rows:
+            self.slots[b].job.publish(pcm[b, 0])
+
+    def _fail_active(self, error):
+        for index, slot in enumerate(self.slots):
+            if slot is not None:
+                self.slots[index] = None
+                slot.job.finish(error)
+        self._release_lm_gen()
+        if self.mimi is not None:
+            self.mimi._stop_streaming()
+            self.mimi = None
+
+    def _release_lm_gen(self):
+        if self.lm_gen is not None:
+            # The LM is streaming-detached from LMGen: its streaming state is
+            # owned by the LMGen state's exit stack, which must be closed too
+            # before another LMGen can stream on the same model.
+            state = self.lm_gen._streaming_state
+            self.lm_gen._stop_streaming()
+            state.__exit__(None, None, None)
+            self.lm_gen = None
+            self.n_q = None
+            self._paused = None
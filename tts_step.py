@@ -0,0 +1,53 @@
+"""Per-step helpers of the streaming TTS loop, shared by the scheduler and the
+standalone scripts. Only depends on torch and moshi."""
+
+import torch
+from moshi.utils.compile import CUDAGraphed
+
+
+def needs_sampled_token(state):
+    """Whether `StateMachine.process` will look at the sampled text token.
+
+    While a word's tokens are still queued or padding is forced the transition
+    is a pad whatever the model sampled, and once padding has run out it is a
+    new word; only the remaining states need the token copied to the host.
+    """
+    return (
+        not state.queued and state.forced_padding <= 0 and state.remaining_padding > 0
+    )
+
+
+class _CompiledOrEager:
+    """`torch.compile`d `func` that permanently falls back to eager if compilation fails."""
+
+    def __init__(self, func):
+        self.func = func
+        self.compiled = torch.compile(func, dynamic=False)
+
+    def __call__(self, *args):
+        if self.compiled is not None:
+            try:
+                return self.compiled(*args)
+            except Exception as e:
+                print(
+                    f"⚠️  torch.compile failed, running {self.func.__name__} eagerly: {e}"
+                )
+                self.compiled = None
+        return self.func(*args)
+
+
+def compile_lm_gen(lm_gen):
+    """Compile the per-step depformer call of a streaming LMGen.
+
+    The depformer runs `dep_q` small transformer steps per frame and dominates
+    launch overhead. Its streaming state is rebuilt on every call, so it traces
+    once and is reused; the main transformer is left alone, as its KV-cache step
+    counter is a Python int that would force a recompile on every frame. On CUDA
+    the compiled function is still captured by LMGen's `CUDAGraphed` (the
+    equivalent of `mode="reduce-overhead"`); on CPU it runs directly.
+    """
+    state = lm_gen._streaming_state
+    if state.graphed_depth is not None:
+        state.graphed_depth = CUDAGraphed(
+            _CompiledOrEager(lm_gen.depformer_step), disable=state.graphed_depth.disable
+        )
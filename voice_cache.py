@@ -0,0 +1,125 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, fields, is_dataclass
+
+import torch
+from moshi.conditioners import TensorCondition
+
+
+@dataclass
+class VoiceCondition:
+    attributes: object
+    condition_tensors: dict
+    nbytes: int
+
+
+def attributes_from_embedding(tts_model, embedding, cfg_coef):
+    """Same layout as `TTSModel.make_condition_attributes` for a single voice,
+    but from an in-memory `speaker_wavs` tensor instead of a safetensors file."""
+    attributes = tts_model.make_condition_attributes([], cfg_coef=cfg_coef)
+    device = tts_model.lm.device
+    emb = embedding.to(device)
+    voice_tensor = torch.zeros(
+        1, tts_model.max_speakers, emb.shape[2], emb.shape[1], device=device
+    )
+    mask = torch.zeros(
+        1, tts_model.max_speakers, emb.shape[2], dtype=torch.bool, device=device
+    )
+    voice_tensor[:, 0, :, :] = emb.transpose(1, 2)
+    mask[:, 0, :] = True
+    attributes.tensor["speaker_wavs"] = TensorCondition(
+        voice_tensor.view(1, -1, voice_tensor.shape[-1]), mask.view(1, -1)
+    )
+    return attributes
+
+
+def _nbytes(obj):
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, dict):
+        return sum(_nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(_nbytes(v) for v in obj)
+    if is_dataclass(obj):
+        # e.g. `TensorCondition`, which holds the voice embedding and its mask.
+        return sum(_nbytes(getattr(obj, f.name)) for f in fields(obj))
+    return 0
+
+
+class VoiceConditionCache:
+    """LRU cache of prepared voice conditioning, keyed by (voice path, cfg_coef).
+
+    Each entry holds the `ConditionAttributes` built from the voice embedding and
+    the condition tensors computed from them by `lm.condition_provider`, so a
+    cache hit skips both the safetensors load and the conditioner forward pass.
+    Entries are evicted least-recently-used first once `max_bytes` is exceeded.
+    """
+
+    def __init__(self, max_bytes=256 * 1024**2):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, tts_model, voice_path, cfg_coef, embedding=None):
+        key = (str(voice_path), float(cfg_coef))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        if embedding is not None:
+            attributes = attributes_from_embedding(tts_model, embedding, cfg_coef)
+        else:
+            attributes = tts_model.make_condition_attributes(
+                [voice_path], cfg_coef=cfg_coef
+            )
+        provider = tts_model.lm.condition_provider
+        with torch.no_grad():
+            condition_tensors = provider(provider.prepare([attributes]))
+        entry = VoiceCondition(
+            attributes,
+            condition_tensors,
+            _nbytes(attributes.tensor) + _nbytes(condition_tensors),
+        )
+
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key).nbytes
+            self.entries[key] = entry
+            self.bytes += entry.nbytes
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, voice_path):
+        voice_path = str(voice_path)
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == voice_path]:
+                self.bytes -= self.entries.pop(key).nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,100 @@
+import io
+import os
+import re
+import tarfile
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import sphn
+import torch
+from safetensors.torch import save_file
+
+SAMPLE_RATE = 24000
+REFERENCE_SECONDS = 10.0
+_UNSAFE_NAME_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def voice_name_from_filename(filename):
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return _UNSAFE_NAME_RE.sub("_", stem).strip("._") or "custom_voice"
+
+
+def iter_uploads(files):
+    """Yield `(filename, wav bytes)` for uploaded WAVs, expanding tar/zip archives."""
+    for upload in files:
+        filename = upload.filename or ""
+        data = upload.read()
+        lower = filename.lower()
+        if lower.endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and info.filename.lower().endswith(".wav"):
+                        yield info.filename, archive.read(info)
+        elif lower.endswith((".tar", ".tar.gz", ".tgz")):
+            with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+                for member in archive.getmembers():
+                    if member.isfile() and member.name.lower().endswith(".wav"):
+                        yield member.name, archive.extractfile(member).read()
+        else:
+            yield filename, data
+
+
+def load_reference(data, seconds=REFERENCE_SECONDS):
+    """Decode WAV bytes to mono 24kHz float32, truncated or zero-padded to `seconds`."""
+    length = int(SAMPLE_RATE * seconds)
+    # sphn only reads from paths; the file is gone before this returns.
+    with tempfile.NamedTemporaryFile(suffix=".wav") as tmp:
+        tmp.write(data)
+        tmp.flush()
+        wav, _ = sphn.read(tmp.name, sample_rate=SAMPLE_RATE)
+    wav = wav[:, :length].mean(axis=0).astype(np.float32)
+    if len(wav) < length:
+        wav = np.pad(wav, (0, length - len(wav)))
+    return wav
+
+
+def load_references(blobs, workers=8):
+    """Decode and resample in a thread pool. Returns one wav or exception per blob."""
+
+    def _load(data):
+        try:
+            return load_reference(data)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_load, blobs))
+
+
+def encode_references(mimi, wavs, device, batch_size=64):
+    """Encode equal-length reference clips with one `encode_to_latent` call per `batch_size`."""
+    embeddings = []
+    for start in range(0, len(wavs), batch_size):
+        batch = torch.from_numpy(np.stack(wavs[start : start + batch_size]))[:, None]
+        with torch.no_grad():
+            emb = mimi.encode_to_latent(batch.to(device), quantize=False)
+        embeddings.extend(emb.cpu().split(1))
+    return embeddings
+
+
+def save_embeddings(items):
+    """Write `(embedding, path)` pairs as `speaker_wavs` safetensors files.
+
+    Everything is written to temporary files first and only then renamed into
+    place, so a failure part way leaves no half-written or partial set of voices.
+    """
+    tmp_paths = []
+    try:
+        for emb, path in items:
+            tmp_path = f"{path}.tmp"
+            tmp_paths.append(tmp_path)
+            save_file({"speaker_wavs": emb.contiguous()}, tmp_path)
+    except Exception:
+        for tmp_path in tmp_paths:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        raise
+    for tmp_path, (_, path) in zip(tmp_paths, items):
+        os.replace(tmp_path, path)
@@ -0,0 +1,132 @@
+"""Packed, memory-mapped store of precomputed voice embeddings.
+
+The store is a directory with two files:
+
+- `index.json`: voice name -> offset and shape in the blob.
+- `embeddings.f32`: every `speaker_wavs` tensor, flattened to float32 and
+  concatenated.
+
+Lookups slice the memory-mapped blob, so they neither copy nor open a file.
+Only the voice repo is packed: custom voices can be re-uploaded at any time,
+so they are always read from their own safetensors file.
+Build it once with `python voice_store.py build` (the server also builds it at
+startup when it is missing).
+"""
+
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+import torch
+from safetensors.torch import load_file
+
+INDEX_FILE = "index.json"
+BLOB_FILE = "embeddings.f32"
+# Voice repo files are named `<voice>.<hash>@<step>.safetensors`.
+_VOICE_SUFFIX_RE = re.compile(r"(\.[0-9a-f]+@\d+)?\.safetensors$")
+
+
+class VoiceStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.voices = {}
+        self.blob = None
+        self.load()
+
+    def load(self):
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, encoding="utf-8") as f:
+            self.voices = json.load(f)["voices"]
+        blob_path = os.path.join(self.directory, BLOB_FILE)
+        if os.path.getsize(blob_path):
+            # Copy-on-write so torch gets a writable view without touching the file.
+            self.blob = np.memmap(blob_path, dtype=np.float32, mode="c")
+
+    def __len__(self):
+        return len(self.voices)
+
+    def __contains__(self, name):
+        return name in self.voices
+
+    def names(self, prefix=None):
+        names = sorted(self.voices)
+        if prefix is not None:
+            names = [n for n in names if n.startswith(prefix)]
+        return names
+
+    def get(self, name):
+        entry = self.voices.get(name)
+        if entry is None or self.blob is None:
+            return None
+        size = int(np.prod(entry["shape"]))
+        view = self.blob[entry["offset"] : entry["offset"] + size]
+        return torch.from_numpy(view).view(*entry["shape"])
+
+
+def voice_name(relative_path):
+    return _VOICE_SUFFIX_RE.sub("", relative_path.replace(os.sep, "/"))
+
+
+def iter_voice_files(directory, prefix=""):
+    for root, _, files in os.walk(directory):
+        for filename in sorted(files):
+            if filename.endswith(".safetensors"):
+                path = os.path.join(root, filename)
+                yield prefix + voice_name(os.path.relpath(path, directory)), path
+
+
+def build(directory, sources):
+    """Pack all `(name, safetensors path)` pairs from `sources` into a store in `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    voices = {}
+    offset = 0
+    blob_tmp = os.path.join(directory, BLOB_FILE + ".tmp")
+    with open(blob_tmp, "wb") as blob:
+        for name, path in sources:
+            emb = load_file(path)["speaker_wavs"].float().contiguous()
+            data = emb.numpy()
+            blob.write(data.tobytes())
+            voices[name] = {"offset": offset, "shape": list(data.shape)}
+            offset += data.size
+    index_tmp = os.path.join(directory, INDEX_FILE + ".tmp")
+    with open(index_tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "dtype": "float32", "voices": voices}, f)
+    os.replace(blob_tmp, os.path.join(directory, BLOB_FILE))
+    os.replace(index_tmp, os.path.join(directory, INDEX_FILE))
+    return VoiceStore(directory)
+
+
+def build_default(directory, voice_repo):
+    from huggingface_hub import snapshot_download
+
+    repo_dir = snapshot_download(voice_repo, allow_patterns=["*.safetensors"])
+    return build(directory, iter_voice_files(repo_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the packed voice embedding store."
+    )
+    parser.add_argument("command", choices=["build", "list"])
+    parser.add_argument(
+        "--out", default=os.getenv("VOICE_STORE_DIR", "/app/voice_store")
+    )
+    parser.add_argument(
+        "--voice-repo", default=os.getenv("VOICE_REPO", "kyutai/tts-voices")
+    )
+    args = parser.parse_args()
+
+    if args.command == "build":
+        store = build_default(args.out, args.voice_repo)
+        print(f"Packed {len(store)} voices into {args.out}")
+    else:
+        for name in VoiceStore(args.out).names():
+            print(name)
+
+
+if __name__ == "__main__":
+    main()